@@ -0,0 +1,101 @@
+"""
+A beam-search alternative to the spiral solver in board.py
+
+We walk the same spiral, but one placement depth at a time: every partial board in the beam is extended
+by every piece that fits the next spot, and only the SOLVE_BEAM_WIDTH children with the lowest cumulative
+fit error (summed over every edge they share with placed pieces) survive to the next depth.
+Memory and run time are bounded by the beam width, at the cost of completeness: if the right partial board
+ever falls out of the beam we won't find the solution from this corner
+"""
+
+import heapq
+
+from common import board
+from common.config import *
+
+
+# rough size of one surviving search node, including its share of the beam and bookkeeping, used to turn the memory ceiling into a beam width
+BYTES_PER_NODE = 256
+
+# print the board every this many depths
+PROGRESS_INTERVAL = 10
+
+
+def beam_width(cells):
+    """
+    The configured beam width, shrunk if needed so that keeping every depth's survivors fits in the memory ceiling
+    """
+    max_nodes = SOLVE_BEAM_MAX_MEMORY_MB * 1024 * 1024 // BYTES_PER_NODE
+    return max(1, min(SOLVE_BEAM_WIDTH, max_nodes // cells))
+
+
+def build_from_corner(index, start_piece_id, edge_length, border=None):
+    """
+    Beam search along the spiral, starting from the corner in the top left
+    If `border` is given, it is a list of (x, y, piece_id, orientation) placements around the border (see frame.py)
+    that are fixed in place before we search the interior
+    """
+    cells = PUZZLE_WIDTH * PUZZLE_HEIGHT
+    width = beam_width(cells)
+    print(f"\n===============================\nBeam searching from corner {start_piece_id} with width {width}...")
+    if border is None:
+        border = [(0, 0, start_piece_id, board._orient_start_corner_to_top_left(index.fits[start_piece_id]))]
+
+    b = board.Board(width=PUZZLE_WIDTH, height=PUZZLE_HEIGHT, index=index)
+    direction = board.RIGHT
+    for (px, py, piece_id, orientation) in border:
+        b.place(piece_id, px, py, orientation)
+    if len(border) > 1:
+        # we came back up the left side to close the frame
+        direction = board.TOP
+    if b.placed_count == cells:
+        return b
+    x, y, direction = board._step(b, px, py, direction)
+    root = board.SearchNode(parent=None, piece_id=piece_id, orientation=orientation, placed_x=px, placed_y=py, x=x, y=y, direction=direction)
+    node = root
+
+    # each beam entry is (cumulative error, search node), kept in the order they were generated
+    # so that neighboring entries share most of their path, and moving the board from one to the next is cheap
+    beam = [(0, root)]
+    for depth in range(len(border) + 1, cells + 1):
+        # the best children so far, as a heap with the worst on top: (-cost, -generation order, parent, piece_id, orientation, next step)
+        survivors = []
+        order = 0
+        for cost, parent in beam:
+            node = board._move_board_to(b, node, parent)
+            x, y, direction = parent.x, parent.y, parent.direction
+            # (x, y) is the only cell the child fills in, so the parent's board can tell us where the spiral goes next
+            step = board._step(b, x, y, direction)
+            index_of_neighbor_in_direction = (direction - parent.orientation) % 4
+            for piece_id, side_index, _ in index.fits[parent.piece_id][index_of_neighbor_in_direction]:
+                orientation = (board.OPPOSITE[direction] - side_index) % 4
+                ok, _ = b.can_place(piece_id=piece_id, x=x, y=y, orientation=orientation)
+                if not ok:
+                    continue
+                order += 1
+                child = (-(cost + b.fit_error(piece_id, x, y, orientation)), -order, parent, piece_id, orientation, step)
+                if len(survivors) < width:
+                    heapq.heappush(survivors, child)
+                elif child > survivors[0]:
+                    heapq.heapreplace(survivors, child)
+
+        if not survivors:
+            raise Exception(f"Beam ran out of candidates at depth {depth}")
+
+        beam = []
+        for negative_cost, _, parent, piece_id, orientation, (next_x, next_y, next_direction) in sorted(survivors, key=lambda child: -child[1]):
+            child = board.SearchNode(parent=parent, piece_id=piece_id, orientation=orientation, placed_x=parent.x, placed_y=parent.y, x=next_x, y=next_y, direction=next_direction)
+            beam.append((-negative_cost, child))
+
+        if depth % PROGRESS_INTERVAL == 0:
+            cost, best = min(beam, key=lambda entry: entry[0])
+            node = board._move_board_to(b, node, best)
+            print("\n" * 40)
+            print(f"Depth {depth} of {cells}, beam of {len(beam)}, best cost {cost}")
+            print(b)
+
+    cost, best = min(beam, key=lambda entry: entry[0])
+    board._move_board_to(b, node, best)
+    print(f"Found solution with cost {cost}!")
+    print(b)
+    return b
@@ -1,8 +1,12 @@
 import os
+import time
 import json
 import math
 import heapq
+import functools
+import multiprocessing
 
+from common import beam, checkpoint, fit_graph, frame, propagate
 from common.config import *
 
 """
@@ -30,6 +34,11 @@ OPPOSITE = {
     TOP: BOTTOM, RIGHT: LEFT, BOTTOM: TOP, LEFT: RIGHT,
 }
 
+# (dx, dy) to step from a cell to its neighbor in each direction
+NEIGHBOR_OFFSETS = {
+    TOP: (0, -1), RIGHT: (1, 0), BOTTOM: (0, 1), LEFT: (-1, 0),
+}
+
 MAX_ITERATIONS_TO_FIND_BORDER = 1000
 MAX_ITERATIONS = 150000000
 
@@ -40,16 +49,38 @@ class Orientation(object):
     ZERO_POINTS_LEFT = 3
 
 
+class FitIndex(object):
+    """
+    Lookup tables compiled once from the connectivity graph, so checking whether a piece
+    can go somewhere is a handful of set and bitmask lookups rather than scans over fit lists
+    """
+    def __init__(self, ps) -> None:
+        # piece_id => the raw fit lists, [(other_piece_id, other_side_index, error), ...] for each side, sorted by error
+        self.fits = ps
+
+        # piece_id => for each side, {(other_piece_id, other_side_index): error} for everything it can plug into
+        self.pairs = {}
+
+        # piece_id => for each orientation, a bitmask of which board directions the piece's edges face
+        self.edge_masks = {}
+
+        for piece_id, fits in ps.items():
+            self.pairs[piece_id] = [{(f[0], f[1]): f[2] for f in fits_i} for fits_i in fits]
+            edge_mask = sum([1 << i for i in range(4) if len(fits[i]) == 0])
+            self.edge_masks[piece_id] = [_rotate_mask(edge_mask, orientation) for orientation in range(4)]
+
+
 class Board(object):
     @staticmethod
     def copy(board):
         # make a deep copy of each element in the board
         _board = [list(e) for e in board._board]
-        return Board(board.width, board.height, _board=_board, _placed_piece_ids=set(board._placed_piece_ids))
+        return Board(board.width, board.height, board.index, _board=_board, _placed_piece_ids=set(board._placed_piece_ids), _history=list(board._history))
 
-    def __init__(self, width, height, _board=None, _placed_piece_ids=None) -> None:
+    def __init__(self, width, height, index, _board=None, _placed_piece_ids=None, _history=None) -> None:
         self.width = width
         self.height = height
+        self.index = index
 
         if _board is not None:
             self._board = _board
@@ -62,6 +93,12 @@ class Board(object):
 
         self._placed_piece_ids = _placed_piece_ids or set()
 
+        # undo log: the (x, y) of each placement, in the order they were made
+        self._history = _history or []
+
+        # for each cell, a bitmask of which directions must be the puzzle's border
+        self._edge_masks = [[sum([1 << side for side in self._sides_that_must_be_edges(x, y)]) for x in range(self.width)] for y in range(self.height)]
+
     def __repr__(self) -> str:
         num_digits = math.floor(math.log(self.width * self.height, 10)) + 3
         s = '\n  ' + '-' * num_digits * self.width + '\n'
@@ -83,7 +120,16 @@ class Board(object):
             return False
         return self._board[y][x] is None
 
-    def can_place(self, piece_id, fits, x, y, orientation):
+    def is_placed(self, piece_id):
+        return piece_id in self._placed_piece_ids
+
+    def edge_mask(self, x, y):
+        """
+        Bitmask of the directions that must be the puzzle's border at (x, y)
+        """
+        return self._edge_masks[y][x]
+
+    def can_place(self, piece_id, x, y, orientation):
         if x < 0 or x >= self.width or y < 0 or y >= self.height:
             return False, f"Cannot place {piece_id} at ({x}, {y}) because it is outside the board"
 
@@ -93,52 +139,63 @@ class Board(object):
         if self._board[y][x] is not None:
             return False, f"Cannot place {piece_id} at ({x}, {y}) because it is already occupied by {self._board[y][x][0]}"
 
-        sides_that_must_be_edges = self._sides_that_must_be_edges(x, y)
-        for side_i in range(4):
-            expect_edge = side_i in sides_that_must_be_edges
-            rotated_i = (side_i - orientation) % 4
-            fits_i = fits[rotated_i]
-            is_edge = len(fits_i) == 0
-            if not is_edge and expect_edge:
-                return False, f"Cannot place {piece_id} at ({x}, {y}) because side @ index {rotated_i} is not an edge piece"
-            elif is_edge and not expect_edge:
-                return False, f"Cannot place {piece_id} at ({x}, {y}) because side @ index {rotated_i} is an edge but it shouldn't be"
+        # the piece's edges must face exactly the sides of the board that are the puzzle's border
+        if self.index.edge_masks[piece_id][orientation] != self._edge_masks[y][x]:
+            return False, f"Cannot place {piece_id} at ({x}, {y}) because its edges don't line up with the border"
 
         # check connectivity of neighbors
-        # if we have someone in a space next to us, let's make sure we connect properly to that space
-        if x > 0 and self._board[y][x - 1] is not None:
-            # check left neighbor has a fit
-            neighbor_piece_id, _, _ = self._board[y][x - 1]
-            rotated_i = (LEFT - orientation) % 4
-            fits_i = [f[0] for f in fits[rotated_i]]
-            if neighbor_piece_id not in fits_i:
-                return False, f"Cannot place {piece_id} at ({x}, {y}) because it does not connect to the right neighbor {neighbor_piece_id} (only connects to {fits_i})"
-        if x < self.width - 1 and self._board[y][x + 1] is not None:
-            # check right neighbor has a fit
-            neighbor_piece_id, _, _ = self._board[y][x + 1]
-            rotated_i = (RIGHT - orientation) % 4
-            fits_i = [f[0] for f in fits[rotated_i]]
-            if neighbor_piece_id not in fits_i:
-                return False, f"Cannot place {piece_id} at ({x}, {y}) because it does not connect to the right neighbor {neighbor_piece_id} (only connects to {fits_i})"
-        if y > 0 and self._board[y - 1][x] is not None:
-            # check top neighbor has a fit
-            neighbor_piece_id, _, _ = self._board[y - 1][x]
-            rotated_i = (TOP - orientation) % 4
-            fits_i = [f[0] for f in fits[rotated_i]]
-            if neighbor_piece_id not in fits_i:
-                return False, f"Cannot place {piece_id} at ({x}, {y}) because it does not connect to the right neighbor {neighbor_piece_id} (only connects to {fits_i})"
-        if y < self.height - 1 and self._board[y + 1][x] is not None:
-            # check bottom neighbor has a fit
-            neighbor_piece_id, _, _ = self._board[y + 1][x]
-            rotated_i = (BOTTOM - orientation) % 4
-            fits_i = [f[0] for f in fits[rotated_i]]
-            if neighbor_piece_id not in fits_i:
-                return False, f"Cannot place {piece_id} at ({x}, {y}) because it does not connect to the right neighbor {neighbor_piece_id} (only connects to {fits_i})"
+        # if we have someone in a space next to us, let's make sure we plug into the side of theirs that faces us
+        pairs = self.index.pairs[piece_id]
+        for direction, (dx, dy) in NEIGHBOR_OFFSETS.items():
+            nx, ny = x + dx, y + dy
+            if nx < 0 or nx >= self.width or ny < 0 or ny >= self.height:
+                continue
+            neighbor = self._board[ny][nx]
+            if neighbor is None:
+                continue
+            neighbor_piece_id, _, neighbor_orientation = neighbor
+            neighbor_side_index = (OPPOSITE[direction] - neighbor_orientation) % 4
+            if (neighbor_piece_id, neighbor_side_index) not in pairs[(direction - orientation) % 4]:
+                return False, f"Cannot place {piece_id} at ({x}, {y}) because it does not connect to the neighbor {neighbor_piece_id}"
         return True, None
 
-    def place(self, piece_id, fits, x, y, orientation):
-        self._board[y][x] = (piece_id, fits, orientation)
+    def fit_error(self, piece_id, x, y, orientation):
+        """
+        The total fit error of the piece at (x, y) against every placed neighbor, assuming can_place allows it
+        """
+        error = 0
+        pairs = self.index.pairs[piece_id]
+        for direction, (dx, dy) in NEIGHBOR_OFFSETS.items():
+            nx, ny = x + dx, y + dy
+            if nx < 0 or nx >= self.width or ny < 0 or ny >= self.height:
+                continue
+            neighbor = self._board[ny][nx]
+            if neighbor is None:
+                continue
+            neighbor_piece_id, _, neighbor_orientation = neighbor
+            neighbor_side_index = (OPPOSITE[direction] - neighbor_orientation) % 4
+            error += pairs[(direction - orientation) % 4][(neighbor_piece_id, neighbor_side_index)]
+        return error
+
+    def place(self, piece_id, x, y, orientation):
+        self._board[y][x] = (piece_id, self.index.fits[piece_id], orientation)
         self._placed_piece_ids.add(piece_id)
+        self._history.append((x, y))
+
+    def undo(self):
+        """
+        Removes the most recently placed piece
+        """
+        x, y = self._history.pop()
+        piece_id, _, _ = self._board[y][x]
+        self._board[y][x] = None
+        self._placed_piece_ids.remove(piece_id)
+
+    def placements(self):
+        """
+        The (x, y, piece_id, orientation) of each placement, in the order they were made
+        """
+        return [(x, y, self._board[y][x][0], self._board[y][x][2]) for (x, y) in self._history]
 
     @property
     def placed_count(self):
@@ -163,27 +220,61 @@ class Board(object):
         return self._board[y][x]
 
 
-def build(connectivity=None, input_path=None, output_path=None):
+class SearchNode(object):
+    """
+    A node in the solver's search tree: the piece it places on top of its parent's board,
+    and where the spiral goes next. Boards are reconstructed by walking parent pointers
+    """
+    __slots__ = ('parent', 'depth', 'piece_id', 'orientation', 'placed_x', 'placed_y', 'x', 'y', 'direction')
+
+    def __init__(self, parent, piece_id, orientation, placed_x, placed_y, x, y, direction) -> None:
+        self.parent = parent
+        self.depth = 1 if parent is None else parent.depth + 1
+        self.piece_id = piece_id
+        self.orientation = orientation
+        self.placed_x = placed_x
+        self.placed_y = placed_y
+        self.x = x
+        self.y = y
+        self.direction = direction
+
+
+def build(connectivity=None, input_path=None, output_path=None, solver=SOLVER, frame_first=SOLVE_FRAME_FIRST, processes=SOLVER_PROCESSES, resume=False):
     """
     Builds the puzzle
     Takes in either a path to a directory that contains the connectivity graph, or the connectivity graph itself
+    `solver` picks the search: 'spiral' for the best-first spiral walk, 'propagate' for forward checking (see propagate.py),
+    or 'beam' for a bounded beam search along the spiral (see beam.py)
+    `frame_first` solves the border on its own before handing it to that search (see frame.py)
+    `processes` > 1 races the corners against each other in a process pool instead of trying them one at a time
+    If `output_path` is given, the spiral solver periodically checkpoints its progress there, and `resume` picks up from those checkpoints
     TODO: somehow pass the output along
     """
-    if connectivity is None:
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver}")
+
+    if connectivity is None and os.path.exists(fit_graph.path_for(input_path)):
         print("> Loading connectivity graph...")
-        with open(os.path.join(input_path, 'connectivity.json'), 'r') as f:
-            ps_raw = json.load(f)
+        ps = fit_graph.load(fit_graph.path_for(input_path))
     else:
-        print("> Using provided connectivity graph...")
-        ps_raw = connectivity
+        if connectivity is None:
+            # from before step 5 wrote the binary format
+            print("> Loading connectivity graph from json...")
+            with open(os.path.join(input_path, 'connectivity.json'), 'r') as f:
+                ps_raw = json.load(f)
+        else:
+            print("> Using provided connectivity graph...")
+            ps_raw = connectivity
 
-    ps = {}
-    for piece_id, fits in ps_raw.items():
-        piece_id = int(piece_id)
-        ps[piece_id] = [[], [], [], []]
-        for i in range(4):
-            for other_piece_id, other_side_id, error in fits[i]:
-                ps[piece_id][i].append((other_piece_id, other_side_id, error))
+        ps = {}
+        for piece_id, fits in ps_raw.items():
+            piece_id = int(piece_id)
+            ps[piece_id] = [[], [], [], []]
+            for i in range(4):
+                for other_piece_id, other_side_id, error in fits[i]:
+                    ps[piece_id][i].append((other_piece_id, other_side_id, error))
+
+    index = FitIndex(ps)
 
     corners = []
     edges = []
@@ -201,9 +292,6 @@ def build(connectivity=None, input_path=None, output_path=None):
     if len(edges) != edge_length:
         raise Exception(f"Expected {edge_length} pieces on the edge, got {len(edges)}")
 
-    success = False
-    solution = None
-
     # For a given puzzle, put the corners in a predictable order using the
     # arbitrary but repeatible heuristic of how many adjacent pieces they would fit.
     # This ensures the solution will appear in the same orientation, for any given puzzle.
@@ -213,46 +301,167 @@ def build(connectivity=None, input_path=None, output_path=None):
         reverse=True # Sort in Descending order
     )
 
+    if processes > 1:
+        return _build_in_parallel(index, corners, edge_length, solver, frame_first, processes, output_path, resume)
 
     for i in range(0, 4):
         try:
-            solution = build_from_corner(ps, start_piece_id=corners[i], edge_length=edge_length)
+            return _build_from_corner(index, corners[i], edge_length, solver, frame_first, output_path, resume)
         except Exception as e:
             print(f"Failed to build from corner {i}: {e}")
-            continue
-        success = True
-        break
 
-    if not success:
+    raise Exception("Failed to solve")
+
+
+def _build_from_corner(index, start_piece_id, edge_length, solver, frame_first, output_path=None, resume=False):
+    build_fn = SOLVERS[solver]
+    if build_fn is build_from_corner and output_path is not None:
+        build_fn = functools.partial(build_from_corner, checkpoint_path=checkpoint.path_for(output_path, start_piece_id), resume=resume)
+    if frame_first:
+        return frame.build_from_corner(build_fn, index, start_piece_id=start_piece_id, edge_length=edge_length)
+    return build_fn(index, start_piece_id=start_piece_id, edge_length=edge_length)
+
+
+def _build_in_parallel(index, corners, edge_length, solver, frame_first, processes, output_path=None, resume=False):
+    """
+    Runs a portfolio of attempts at once and takes whichever solves first, terminating the rest:
+    every corner with the configured solver, then (if there are spare processes) every corner with the other solvers too
+    """
+    attempts = [(corner, solver) for corner in corners]
+    if processes > len(attempts):
+        attempts += [(corner, other) for other in SOLVERS if other != solver for corner in corners]
+    args = [(corner, edge_length, s, frame_first, output_path, resume) for (corner, s) in attempts]
+
+    solution = None
+    with multiprocessing.Pool(processes=min(processes, len(args)), initializer=_init_worker, initargs=(index,)) as pool:
+        for corner, s, placements, err in pool.imap_unordered(_build_from_corner_in_worker, args):
+            if placements is None:
+                print(f"Failed to build from corner {corner} with the {s} solver: {err}")
+                continue
+            print(f"Corner {corner} with the {s} solver found a solution first")
+            solution = Board(width=PUZZLE_WIDTH, height=PUZZLE_HEIGHT, index=index)
+            for (x, y, piece_id, orientation) in placements:
+                solution.place(piece_id, x, y, orientation)
+            break
+        # leaving the pool terminates any attempts that are still running
+
+    if solution is None:
         raise Exception("Failed to solve")
+
+    # whichever attempt won, turn the board so the first of our sorted corners that it can put in the top left ends up there,
+    # so the orientation doesn't depend on which attempt happened to finish first. That isn't necessarily the corner
+    # building in order would have succeeded from: on a non-square board we can only turn it half way around, so if
+    # the first corner lands where we can't turn it to the top left, a later corner goes there instead
+    for corner in corners:
+        turns = _turns_to_top_left(solution, corner)
+        if turns is not None:
+            break
+    for _ in range(turns):
+        solution = _rotated_clockwise(solution)
+    print(solution)
     return solution
 
-def build_from_corner(ps, start_piece_id, edge_length):
-    print(f"\n===============================\nBuilding from corner {start_piece_id}...")
-    start_piece_fits = ps[start_piece_id]
-    start_orientation = _orient_start_corner_to_top_left(start_piece_fits)
-    board = Board(width=PUZZLE_WIDTH, height=PUZZLE_HEIGHT)
 
-    x, y = (0, 0)
-    board.place(start_piece_id, start_piece_fits, x, y, start_orientation)
+# Each worker process gets its own copy of the fit index once, rather than with every attempt
+_worker_index = None
 
-    direction = RIGHT
-    x += 1
 
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _build_from_corner_in_worker(args):
+    """
+    Returns the solution as a list of placements, since those are much cheaper to send back than a Board
+    """
+    start_piece_id, edge_length, solver, frame_first, output_path, resume = args
+    try:
+        solution = _build_from_corner(_worker_index, start_piece_id, edge_length, solver, frame_first, output_path, resume)
+    except Exception as e:
+        return start_piece_id, solver, None, str(e)
+    return start_piece_id, solver, solution.placements(), None
+
+
+def _turns_to_top_left(board, piece_id):
+    """
+    How many clockwise quarter turns bring the piece to the top left without changing the board's dimensions,
+    or None if that piece isn't in a corner we can turn there
+    """
+    corners = [(0, 0), (0, board.height - 1), (board.width - 1, board.height - 1), (board.width - 1, 0)]
+    for turns, (x, y) in enumerate(corners):
+        if turns % 2 == 1 and board.width != board.height:
+            continue
+        if board.get(x, y)[0] == piece_id:
+            return turns
+    return None
+
+
+def _rotated_clockwise(board):
+    """
+    Returns a copy of the board turned a quarter turn clockwise
+    """
+    rotated = Board(width=board.height, height=board.width, index=board.index)
+    for (x, y, piece_id, orientation) in board.placements():
+        rotated.place(piece_id, board.height - 1 - y, x, (orientation + 1) % 4)
+    return rotated
+
+
+def build_from_corner(index, start_piece_id, edge_length, border=None, checkpoint_path=None, resume=False):
+    """
+    Best-first search along the spiral, starting from the corner in the top left
+    If `border` is given, it is a list of (x, y, piece_id, orientation) placements around the border (see frame.py)
+    that are fixed in place before we search the interior
+    If `checkpoint_path` is given, the frontier is saved there every SOLVE_CHECKPOINT_INTERVAL seconds,
+    and with `resume` we start from the frontier saved there instead of from scratch
+    """
+    print(f"\n===============================\nBuilding from corner {start_piece_id}...")
+    if border is None:
+        border = [(0, 0, start_piece_id, _orient_start_corner_to_top_left(index.fits[start_piece_id]))]
+
+    # We keep a single board around and move it between nodes of the search tree by undoing and redoing placements,
+    # so each node on the frontier only costs the handful of fields in a SearchNode rather than a full copy of the board
+    board = Board(width=PUZZLE_WIDTH, height=PUZZLE_HEIGHT, index=index)
+    direction = RIGHT
+    for (px, py, piece_id, orientation) in border:
+        board.place(piece_id, px, py, orientation)
+    if len(border) > 1:
+        # we came back up the left side to close the frame
+        direction = TOP
+    x, y, direction = _step(board, px, py, direction)
+    root = SearchNode(parent=None, piece_id=piece_id, orientation=orientation, placed_x=px, placed_y=py, x=x, y=y, direction=direction)
+    node = root
+
+    # ties on error are broken by depth (shallower first), then by the order we pushed them in
+    pushed = 0
     priority_q = []
-    initial_push = (board, start_piece_id, start_orientation, x, y, direction)
-    heapq.heappush(priority_q, (0, initial_push))
+    heapq.heappush(priority_q, (0, root.depth, pushed, root))
 
     iteration = 0
     longest = 0
+    best = board.placements()
+
+    saved = checkpoint.load(checkpoint_path, start_piece_id, border) if (checkpoint_path and resume) else None
+    if saved is not None:
+        root, priority_q, iteration, longest, pushed, best = saved
+        node = root
+        print(f"Resuming from iteration {iteration} with {len(priority_q)} boards on the frontier, longest: {longest}")
+    last_checkpoint = time.time()
+
     while priority_q:
-        priority, data = heapq.heappop(priority_q)
-        board, start_piece_id, start_orientation, x, y, direction = data
+        priority, depth, order, next_node = heapq.heappop(priority_q)
+        node = _move_board_to(board, node, next_node)
+        x, y, direction = node.x, node.y, node.direction
         if iteration % 100 == 0:
             print("\n" * 40)
             print(f"Iteration {iteration} with length {board.placed_count}, cost {priority}, longest: {longest}")
             print(board)
 
+            if checkpoint_path and time.time() - last_checkpoint > SOLVE_CHECKPOINT_INTERVAL:
+                # the node we just popped hasn't been expanded yet, so it goes back on the saved frontier
+                checkpoint.save(checkpoint_path, start_piece_id, border, root, priority_q + [(priority, depth, order, node)], iteration, longest, pushed, best)
+                last_checkpoint = time.time()
+
             if (iteration > MAX_ITERATIONS_TO_FIND_BORDER and longest < edge_length) or iteration > MAX_ITERATIONS:
                 raise Exception("Too many iterations, I think we chose the wrong corner")
 
@@ -261,37 +470,70 @@ def build_from_corner(ps, start_piece_id, edge_length):
             break
         elif board.placed_count > longest:
             longest = board.placed_count
+            best = board.placements()
 
-        index_of_neighbor_in_direction = (direction - start_orientation) % 4
+        index_of_neighbor_in_direction = (direction - node.orientation) % 4
         iteration += 1
 
-        for neighbor_piece_id, neighbor_side_index, error in ps[start_piece_id][index_of_neighbor_in_direction]:
+        for neighbor_piece_id, neighbor_side_index, error in index.fits[node.piece_id][index_of_neighbor_in_direction]:
             neighbor_orientation = (OPPOSITE[direction] - neighbor_side_index) % 4
-            ok, err = board.can_place(piece_id=neighbor_piece_id, fits=ps[neighbor_piece_id], x=x, y=y, orientation=neighbor_orientation)
+            ok, err = board.can_place(piece_id=neighbor_piece_id, x=x, y=y, orientation=neighbor_orientation)
             if ok:
-                next_board = Board.copy(board)
-                next_board.place(neighbor_piece_id, ps[neighbor_piece_id], x, y, neighbor_orientation)
-                next_direction = direction
-                next_x = x + (1 if next_direction == RIGHT else -1 if next_direction == LEFT else 0)
-                next_y = y + (1 if next_direction == BOTTOM else -1 if next_direction == TOP else 0)
-
-                if not next_board.is_available(next_x, next_y):
-                    # if we can't go further in this direction, time to turn
-                    next_direction = (direction + 1) % 4
-                    next_x = x + (1 if next_direction == RIGHT else -1 if next_direction == LEFT else 0)
-                    next_y = y + (1 if next_direction == BOTTOM else -1 if next_direction == TOP else 0)
-
-                data = [next_board, neighbor_piece_id, neighbor_orientation, next_x, next_y, next_direction]
-                heapq.heappush(priority_q, (error, data))
+                # (x, y) is the only cell the child fills in, and we never step back onto it
+                # so the current board can answer availability on the child's behalf
+                next_x, next_y, next_direction = _step(board, x, y, direction)
+                child = SearchNode(parent=node, piece_id=neighbor_piece_id, orientation=neighbor_orientation, placed_x=x, placed_y=y, x=next_x, y=next_y, direction=next_direction)
+                pushed += 1
+                heapq.heappush(priority_q, (error, child.depth, pushed, child))
 
     if board.placed_count == PUZZLE_WIDTH * PUZZLE_HEIGHT:
         print(f"Found solution after {iteration} iterations!")
         print(board)
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
         return board
     else:
         raise Exception(f"No solution found after {iteration} iterations, longest found: {longest}")
 
 
+def _step(board, x, y, direction):
+    """
+    Where the spiral goes after (x, y): keep going in `direction`, or turn clockwise if that spot is taken or off the board
+    """
+    next_x = x + (1 if direction == RIGHT else -1 if direction == LEFT else 0)
+    next_y = y + (1 if direction == BOTTOM else -1 if direction == TOP else 0)
+    if not board.is_available(next_x, next_y):
+        # if we can't go further in this direction, time to turn
+        direction = (direction + 1) % 4
+        next_x = x + (1 if direction == RIGHT else -1 if direction == LEFT else 0)
+        next_y = y + (1 if direction == BOTTOM else -1 if direction == TOP else 0)
+    return next_x, next_y, direction
+
+
+def _move_board_to(board, current, target):
+    """
+    Rewinds the board from the `current` search node back to the nearest common ancestor with `target`,
+    then replays placements down to `target`. Returns `target`
+    """
+    replay = []
+    destination = target
+    while target.depth > current.depth:
+        replay.append(target)
+        target = target.parent
+    while current.depth > target.depth:
+        board.undo()
+        current = current.parent
+    while current is not target:
+        board.undo()
+        current = current.parent
+        replay.append(target)
+        target = target.parent
+
+    for node in reversed(replay):
+        board.place(node.piece_id, node.placed_x, node.placed_y, node.orientation)
+    return destination
+
+
 def _orient_start_corner_to_top_left(p):
     if len(p[0]) == 0 and len(p[1]) == 0:
         # ''|   --> |''
@@ -307,3 +549,17 @@ def _orient_start_corner_to_top_left(p):
         return Orientation.ZERO_POINTS_UP
     else:
         raise ValueError(f"Piece {p} is not a corner piece")
+
+
+def _rotate_mask(mask, orientation):
+    """
+    Rotates a 4-bit mask of piece sides into board directions: side i faces direction (i + orientation) % 4
+    """
+    return ((mask << orientation) | (mask >> (4 - orientation))) & 0b1111
+
+
+SOLVERS = {
+    'spiral': build_from_corner,
+    'propagate': propagate.build_from_corner,
+    'beam': beam.build_from_corner,
+}
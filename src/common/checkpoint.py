@@ -0,0 +1,94 @@
+"""
+Saves and restores the spiral solver's progress, so a long search that gets killed can pick up where it left off
+
+A checkpoint is a compressed .npz of flat arrays: every search node still reachable from the frontier
+(one row each, parents before children), the frontier itself, the border we started from,
+and the longest partial board found so far
+"""
+
+import os
+import heapq
+
+import numpy as np
+
+from common import board
+from common.config import *
+
+
+# bump this if the layout of the arrays below changes
+VERSION = 1
+
+
+def path_for(output_path, start_piece_id):
+    return os.path.join(output_path, f'checkpoint_{start_piece_id}.npz')
+
+
+def save(path, start_piece_id, border, root, frontier, iteration, longest, pushed, best) -> None:
+    """
+    Writes the search state to `path`: `frontier` is every (error, depth, pushed, node) still to be expanded
+    and `best` the placements of the longest board so far
+    """
+    # number every node that's still reachable, parents first, so each row can point back at its parent's row
+    rows = {}
+    nodes = []
+    for n in [root] + [entry[3] for entry in frontier]:
+        chain = []
+        while n is not None and id(n) not in rows:
+            chain.append(n)
+            n = n.parent
+        for n in reversed(chain):
+            rows[id(n)] = len(nodes)
+            nodes.append(n)
+
+    tree = np.array([
+        (-1 if n.parent is None else rows[id(n.parent)], n.piece_id, n.orientation, n.placed_x, n.placed_y, n.x, n.y, n.direction)
+        for n in nodes
+    ], dtype=np.int32).reshape(-1, 8)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            meta=np.array([VERSION, PUZZLE_WIDTH, PUZZLE_HEIGHT, start_piece_id, iteration, longest, pushed], dtype=np.int64),
+            border=np.array(border, dtype=np.int32).reshape(-1, 4),
+            tree=tree,
+            frontier_errors=np.array([entry[0] for entry in frontier], dtype=np.float64),
+            frontier_pushed=np.array([entry[2] for entry in frontier], dtype=np.int64),
+            frontier_nodes=np.array([rows[id(entry[3])] for entry in frontier], dtype=np.int32),
+            best=np.array(best, dtype=np.int32).reshape(-1, 4),
+        )
+    # swap it in all at once, so getting killed mid-write never leaves us with a corrupt checkpoint
+    os.replace(tmp_path, path)
+
+
+def load(path, start_piece_id, border):
+    """
+    Reads back a checkpoint saved by `save` as (root, frontier, iteration, longest, pushed, best),
+    or returns None if there isn't one for this corner, puzzle and border
+    """
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        version, width, height, saved_start_piece_id, iteration, longest, pushed = [int(v) for v in data['meta']]
+        if version != VERSION or (width, height, saved_start_piece_id) != (PUZZLE_WIDTH, PUZZLE_HEIGHT, start_piece_id):
+            print(f"Ignoring checkpoint {path}, it was saved for a different puzzle")
+            return None
+        if [tuple(p) for p in data['border'].tolist()] != [tuple(p) for p in border]:
+            print(f"Ignoring checkpoint {path}, it was saved for a different border")
+            return None
+
+        nodes = []
+        for parent_row, piece_id, orientation, placed_x, placed_y, x, y, direction in data['tree'].tolist():
+            parent = None if parent_row < 0 else nodes[parent_row]
+            nodes.append(board.SearchNode(parent=parent, piece_id=piece_id, orientation=orientation, placed_x=placed_x, placed_y=placed_y, x=x, y=y, direction=direction))
+
+        frontier = [
+            (error, nodes[row].depth, p, nodes[row])
+            for error, p, row in zip(data['frontier_errors'].tolist(), data['frontier_pushed'].tolist(), data['frontier_nodes'].tolist())
+        ]
+        heapq.heapify(frontier)
+        best = [tuple(p) for p in data['best'].tolist()]
+
+    # the root is always numbered first
+    return nodes[0], frontier, iteration, longest, pushed, best
@@ -27,6 +27,15 @@ APPROX_ROBOT_COUNTS_PER_PIXEL = 10
 DUPLICATE_CENTROID_DELTA_PX = 22.0
 
 
+# Solving
+SOLVER = 'spiral'  # 'spiral' walks the border then spirals inward best-first, 'propagate' fills the most constrained cell first with forward checking, 'beam' keeps the best SOLVE_BEAM_WIDTH partial boards at each depth of the spiral
+SOLVE_FRAME_FIRST = False  # find the border as a closed loop of edge pieces before searching the interior
+SOLVE_BEAM_WIDTH = 1000  # how many partial boards the beam keeps per depth
+SOLVE_BEAM_MAX_MEMORY_MB = 2048  # the beam is narrowed if needed so the search tree stays under this
+SOLVE_CHECKPOINT_INTERVAL = 60  # seconds between saves of the spiral solver's progress to the solution directory, for resuming with --resume
+SOLVER_PROCESSES = 8  # race the corners (and, with processes to spare, the other solvers) in parallel; 1 tries each corner in turn
+
+
 # Directory structure for data processing
 # Step 1 takes in photos of pieces on the bed and outputs binary BMPs of those photos
 PHOTOS_DIR = '0_photos'
@@ -44,6 +53,10 @@ DEDUPED_DIR = '4_deduped'
 # Step 5 takes in SVGs and outputs a graph of connectivity
 CONNECTIVITY_DIR = '5_connectivity'
 
+# Step 5 also keeps the raw errors between every pair of sides it scored here, so it can be rerun with different thresholds
+# without scoring everything again. This isn't cleared between runs: it's keyed by the shape of each side
+CACHE_DIR = '5_cache'
+
 # Step 6 takes in the graph of connectivity and outputs a solution
 SOLUTION_DIR = '6_solution'
 
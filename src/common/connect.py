@@ -1,12 +1,31 @@
 import os
-import json
 from typing import List
 import multiprocessing
+from multiprocessing import shared_memory
 
-from common import pieces, sides
+import numpy as np
+from scipy.spatial import cKDTree
 
+from common import error_cache, fit_graph, pieces, sides, util
 
-# Building the graph took 440.38 seconds
+
+# Building the graph took 440.38 seconds (before we started scoring each pair of sides only once)
+
+# how much memory the differences between two blocks of sides can take while we score them
+CONNECT_MEMORY_BUDGET_MB = 512
+
+# roughly how many bytes scoring one pair of sides takes at once: the (VERTEX_COUNT, 2) differences and a few temporaries the same size
+BYTES_PER_PAIR = 6 * (sides.SIDE_RESAMPLE_VERTEX_COUNT + 1) * 2 * 8
+
+# only score each side against this many sides whose shape descriptors are nearest to it (see sides.descriptors),
+# or 0 to score it against every side of a similar length
+NEAREST_NEIGHBORS = 100
+
+# pairs of sides that don't fit better than this either way are thrown away as soon as they're scored (see _error_ceiling)
+ERROR_CEILING = 10.0
+
+# with a cache, we only score the pairs of sides that include a new or changed side, unless more than this fraction of them are
+INCREMENTAL_MAX_NEW_FRACTION = 0.5
 
 
 # Useful for debugging - punch in the piece ids and side ids that should match
@@ -20,48 +39,377 @@ SOLUTION = [
 ]
 
 
-def build(input_path, output_path):
+def build(input_path, output_path, cache_path=None):
+    """
+    Scores how well every side plugs into every other, and saves the best fits for each side as the connectivity graph
+    If `cache_path` is given, the raw errors between sides are cached there, so rerunning with different thresholds is quick,
+    and when only a few pieces were added, removed or re-photographed since, only the pairs of sides they're in get scored
+    """
     print("> Loading piece data...")
     ps = pieces.Piece.load_all(input_path, resample=True)
     print("\t ...Loaded")
 
-    with multiprocessing.Pool(processes=8) as pool:
-        results = [pool.apply_async(_find_potential_matches_for_piece, (ps, piece_id)) for piece_id in ps.keys()]
-        out = [r.get() for r in results]
+    piece_ids = sorted(ps.keys())
+    tensor = SideTensor.create([ps[piece_id] for piece_id in piece_ids])
+    try:
+        scored = _score_pairs(tensor, piece_ids, cache_path)
+        _check_solution(tensor, piece_ids, scored)
+    finally:
+        tensor.close(unlink=True)
+
+    for (i, si, j, sj, error) in _matches(*scored):
+        ps[piece_ids[i]].fits[si].append((piece_ids[j], sj, error))
+
+    for piece_id in piece_ids:
+        _keep_best_matches(ps[piece_id])
 
-    ps = { piece_id: piece for (piece_id, piece) in out }
     return _save(ps, output_path)
 
 
-def _find_potential_matches_for_piece(ps, piece_id, debug=False):
+def _score_pairs(tensor, piece_ids, cache_path):
     """
-    Find other sides that fit with this piece's sides
+    Returns (rows, columns, errors, errors_reversed): flat side indices (piece index * 4 + side index) of each pair of sides
+    worth keeping, the error when the row side plugs into the column side, and the error the other way around
     """
-    piece = ps[piece_id]
+    # anything that changes the errors we'd compute, or which pairs we'd compute them for
+    params = f'{sides.SIDE_RESAMPLE_VERTEX_COUNT}:{sides.SIDE_MAX_LENGTH_DISCREPANCY}:{NEAREST_NEIGHBORS}:{_error_ceiling()}'
+    cached = None
+    if cache_path is not None:
+        keys = error_cache.side_keys(tensor.data, piece_ids)
+        cached = error_cache.load(cache_path, params, keys)
 
-    # for all other piece's sides, find the ones that fit with this piece's sides
-    for si, side in enumerate(piece.sides):
-        if side.is_edge:
-            continue
+    # Workers read the sides straight out of one shared block of memory rather than each being sent a copy of every piece,
+    # so all a task needs is which sides to score against which
+    order = _sides_by_length(tensor)
+    nearest = NEAREST_NEIGHBORS and NEAREST_NEIGHBORS < len(order)
 
-        for other_piece_id, other_piece in ps.items():
-            if other_piece_id == piece_id:
-                continue
+    new = None
+    if cached is not None:
+        *cached, new = cached
+        if not new.any() and not nearest:
+            print(f"> Using {len(cached[0])} cached pairs of sides")
+            return tuple(cached)
+        if not nearest and new.mean() > INCREMENTAL_MAX_NEW_FRACTION:
+            # so much has changed that it's quicker to score everything again than to work out which pairs are new
+            cached, new = None, None
+        else:
+            changed = sorted(set(piece_ids[i] for i in np.nonzero(new)[0] // 4))
+            print(f"> Using {len(cached[0])} cached pairs of sides")
+            if changed:
+                print(f"\t{len(changed)} pieces are new or have changed: {changed}")
+
+    # the fit between two sides is symmetric enough that we only score each pair once, and record it on both
+    with multiprocessing.Pool(processes=8, initializer=_attach_worker, initargs=(tensor.name, tensor.piece_count, piece_ids, order)) as pool:
+        if nearest:
+            pairs = _nearest_pairs(tensor, order)
+            if cached is not None:
+                # we keep every pair we score this way, so anything missing from the cache hasn't been scored yet,
+                # and anything in it that isn't among the nearest any more (pieces were removed or changed) is dropped
+                cached, pairs = _split_cached_pairs(cached, pairs, len(keys))
+            print(f"Scoring {len(pairs)} pairs of sides with similar shapes")
+            results = [pool.apply_async(_score_pairs_of_sides, (rows, columns, True)) for (rows, columns) in _chunks(pairs)]
+        elif new is not None:
+            results = [pool.apply_async(_score_pairs_of_sides, chunk) for chunk in _chunks(_pairs_with_new_sides(tensor, order, new))]
+        else:
+            results = [pool.apply_async(_score_block, block) for block in _blocks(tensor, order)]
+        out = [r.get() for r in results]
+    if cached is not None:
+        out.append(cached)
+    scored = tuple(np.concatenate([o[k] for o in out]) if out else np.zeros(0) for k in range(4))
+
+    if cache_path is not None:
+        error_cache.save(cache_path, params, keys, *scored)
+    return scored
+
+
+def _error_ceiling():
+    """
+    Pairs that are worse than this both ways aren't kept around at all (nor cached): a generous multiple of the threshold for a match,
+    so loosening SIDE_MAX_ERROR_TO_MATCH a bit doesn't mean scoring everything again
+    """
+    return max(ERROR_CEILING, sides.SIDE_MAX_ERROR_TO_MATCH)
+
+
+def _matches(rows, columns, errors, errors_reversed):
+    """
+    The (i, side_index, j, other_side_index, error) of every match, in both directions, from scored pairs of sides
+    """
+    matches = []
+    for (i, j, errs) in [(rows, columns, errors), (columns, rows, errors_reversed)]:
+        fit = errs <= sides.SIDE_MAX_ERROR_TO_MATCH
+        for a, b, error in zip(i[fit].tolist(), j[fit].tolist(), errs[fit].tolist()):
+            matches.append((a // 4, a % 4, b // 4, b % 4, error))
+    return matches
+
+
+class SideTensor(object):
+    """
+    Every piece's resampled sides packed into one (pieces, 4, SIDE_COLUMNS) float array in shared memory,
+    which worker processes attach to without copying. Each side's row holds its vertices, then its flipped vertices
+    (both flattened x, y pairs), then its polyline length, its end to end length, and 1.0 if it's an edge
+    """
+    VERTEX_COUNT = sides.SIDE_RESAMPLE_VERTEX_COUNT + 1
+    VERTICES = slice(0, 2 * VERTEX_COUNT)
+    VERTICES_FLIPPED = slice(2 * VERTEX_COUNT, 4 * VERTEX_COUNT)
+    V_LENGTH = 4 * VERTEX_COUNT
+    LENGTH = 4 * VERTEX_COUNT + 1
+    IS_EDGE = 4 * VERTEX_COUNT + 2
+    SIDE_COLUMNS = 4 * VERTEX_COUNT + 3
+
+    @classmethod
+    def create(cls, ps):
+        """
+        Packs the sides of the given pieces, in order, into a new block of shared memory
+        """
+        shape = (len(ps), 4, cls.SIDE_COLUMNS)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(np.float64).itemsize))
+        tensor = cls(shm, len(ps))
+        for i, piece in enumerate(ps):
+            for si, side in enumerate(piece.sides):
+                row = tensor.data[i, si]
+                row[cls.VERTICES] = np.asarray(side.vertices, dtype=np.float64).reshape(-1)
+                row[cls.VERTICES_FLIPPED] = np.asarray(side.vertices_flipped, dtype=np.float64).reshape(-1)
+                row[cls.V_LENGTH] = side.v_length
+                row[cls.LENGTH] = side.length
+                row[cls.IS_EDGE] = 1.0 if side.is_edge else 0.0
+        return tensor
+
+    @classmethod
+    def attach(cls, name, piece_count):
+        return cls(shared_memory.SharedMemory(name=name), piece_count)
+
+    def __init__(self, shm, piece_count) -> None:
+        self._shm = shm
+        self.name = shm.name
+        self.piece_count = piece_count
+        self.data = np.ndarray((piece_count, 4, self.SIDE_COLUMNS), dtype=np.float64, buffer=shm.buf)
+
+        # views into the data, no copies
+        self.vertices = self.data[:, :, self.VERTICES].reshape(piece_count, 4, self.VERTEX_COUNT, 2)
+        self.vertices_flipped = self.data[:, :, self.VERTICES_FLIPPED].reshape(piece_count, 4, self.VERTEX_COUNT, 2)
+        self.v_length = self.data[:, :, self.V_LENGTH]
+        self.length = self.data[:, :, self.LENGTH]
+
+    @property
+    def is_edge(self):
+        return self.data[:, :, self.IS_EDGE] > 0.5
+
+    def close(self, unlink=False) -> None:
+        # drop our views before closing, numpy arrays keep the buffer exported
+        self.data = self.vertices = self.vertices_flipped = self.v_length = self.length = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
 
-            for sj, other_side in enumerate(other_piece.sides):
-                if other_side.is_edge:
-                    continue
 
-                # for debugging, we can optionally provide side-matches from the actual solution and see how well the algo thinks they fit together
-                part_of_solution = ([(piece_id, si), (other_piece_id, sj)] in SOLUTION) or ([(other_piece_id, sj), (piece_id, si)] in SOLUTION)
+# The tensor, piece ids and length-sorted sides each worker process attached to
+_tensor = None
+_piece_ids = None
+_order = None
 
-                # compute the error between our piece's side and this other piece's side
-                error = side.error_when_fit_with(other_side, render=part_of_solution or debug, debug_str=f'{piece_id}[{si}] vs {other_piece_id}[{sj}]')
-                if error <= sides.SIDE_MAX_ERROR_TO_MATCH:
-                    piece.fits[si].append((other_piece.id, sj, error))
 
-                if error > sides.SIDE_MAX_ERROR_TO_MATCH and part_of_solution:
-                    raise ValueError(f"Should have matched but didn't: {piece_id}[{si}] vs {other_piece_id}[{sj}]")
+def _attach_worker(name, piece_count, piece_ids, order):
+    global _tensor, _piece_ids, _order
+    _tensor = SideTensor.attach(name, piece_count)
+    _piece_ids = piece_ids
+    _order = order
+
+
+def _sides_by_length(t):
+    """
+    The flat indices (piece index * 4 + side index) of every side that isn't an edge, shortest first
+    """
+    lengths = t.length.reshape(-1)
+    candidates = np.nonzero(~t.is_edge.reshape(-1))[0]
+    return candidates[np.argsort(lengths[candidates], kind='stable')]
+
+
+def _blocks(t, order):
+    """
+    Splits the length-sorted sides into blocks of rows small enough that scoring them against a block of columns
+    stays within CONNECT_MEMORY_BUDGET_MB. Returns (start, stop, window) for each block of rows, where
+    window is where the block's columns end: two sides can only fit if the shorter is within SIDE_MAX_LENGTH_DISCREPANCY
+    of the longer (measured either way), so a side only needs scoring against the ones after it up to 1 / (1 - discrepancy) times its length
+    """
+    max_pairs = CONNECT_MEMORY_BUDGET_MB * 1024 * 1024 // BYTES_PER_PAIR
+    block_size = max(1, int(max_pairs ** 0.5))
+    lengths = t.length.reshape(-1)[order]
+    blocks = []
+    for start in range(0, len(order), block_size):
+        stop = min(len(order), start + block_size)
+        window = int(np.searchsorted(lengths, lengths[stop - 1] / (1.0 - sides.SIDE_MAX_LENGTH_DISCREPANCY), side='right'))
+        blocks.append((start, stop, window))
+    return blocks
+
+
+def _score_block(start, stop, window):
+    """
+    Scores the length-sorted sides from `start` to `stop` against the sides after each of them up to `window`, both ways
+    Returns (rows, columns, errors, errors_reversed) like _score_pairs, for the pairs under the error ceiling
+    """
+    scored = []
+    block_size = stop - start
+    for column_start in range(start, window, block_size):
+        column_stop = min(window, column_start + block_size)
+        rows, columns = _order[start:stop], _order[column_start:column_stop]
+
+        if column_start == start:
+            # against itself, the block's forward errors already cover every ordered pair
+            errors, _ = _errors_between_sides(_tensor, rows[:, np.newaxis], columns[np.newaxis, :], reverse=False)
+            a, b = np.triu_indices(len(rows), k=1)
+            scored.append(_below_ceiling(rows[a], columns[b], errors[a, b], errors[b, a]))
+        else:
+            errors, errors_reversed = _errors_between_sides(_tensor, rows[:, np.newaxis], columns[np.newaxis, :])
+            a, b = np.indices(errors.shape).reshape(2, -1)
+            scored.append(_below_ceiling(rows[a], columns[b], errors[a, b], errors_reversed[a, b]))
+    return tuple(np.concatenate([s[k] for s in scored]) for k in range(4))
+
+
+def _pairs_with_new_sides(t, order, new):
+    """
+    Every pair of sides that _blocks would have us score and that includes a new side (`new` is a mask over flat side indices),
+    as an array of (row, column) flat side indices, each pair the same way around as _score_block has it: the shorter side first
+    """
+    lengths = t.length.reshape(-1)[order]
+    is_new = new[order]
+    # everything a side could fit with, either way, is within this range of lengths
+    starts = np.searchsorted(lengths, lengths * (1.0 - sides.SIDE_MAX_LENGTH_DISCREPANCY), side='left')
+    stops = np.searchsorted(lengths, lengths / (1.0 - sides.SIDE_MAX_LENGTH_DISCREPANCY), side='right')
+
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    for p in np.nonzero(is_new)[0]:
+        q = np.arange(starts[p], stops[p])
+        # pairs of two new sides are picked up by whichever comes first
+        q = q[(q != p) & ~(is_new[q] & (q < p))]
+        pairs.append(np.stack([np.minimum(p, q), np.maximum(p, q)], axis=1))
+    pairs = order[np.concatenate(pairs)]
+    print(f"Scoring {len(pairs)} pairs of sides with new or changed sides")
+    return pairs
+
+
+def _nearest_pairs(t, order):
+    """
+    Looks up the NEAREST_NEIGHBORS sides whose flipped descriptors are closest to each side's descriptor,
+    and returns the distinct pairs of sides that turned up, as an array of (row, column) flat side indices with row < column
+    """
+    vertices = t.vertices.reshape(-1, SideTensor.VERTEX_COUNT, 2)[order]
+    vertices_flipped = t.vertices_flipped.reshape(-1, SideTensor.VERTEX_COUNT, 2)[order]
+    tree = cKDTree(sides.descriptors(vertices_flipped))
+    _, nearest = tree.query(sides.descriptors(vertices), k=NEAREST_NEIGHBORS)
+
+    rows = np.repeat(order, NEAREST_NEIGHBORS)
+    columns = order[nearest.reshape(-1)]
+    keep = rows // 4 != columns // 4
+
+    # each pair is scored both ways at once, so we only need it once whichever side found the other
+    return np.unique(np.stack([np.minimum(rows, columns)[keep], np.maximum(rows, columns)[keep]], axis=1), axis=0)
+
+
+def _split_cached_pairs(cached, pairs, side_count):
+    """
+    Returns the cached (rows, columns, errors, errors_reversed) for just the given pairs, and the pairs that aren't cached
+    """
+    rows, columns = cached[0], cached[1]
+    # cached sides keep their order when pieces are added or removed around them, so rows are still below columns
+    cached_pairs = rows.astype(np.int64) * side_count + columns
+    wanted = pairs[:, 0].astype(np.int64) * side_count + pairs[:, 1]
+    keep = np.isin(cached_pairs, wanted)
+    return tuple(c[keep] for c in cached), pairs[~np.isin(wanted, cached_pairs)]
+
+
+def _chunks(pairs):
+    """
+    Splits an array of (row, column) pairs into (rows, columns) chunks small enough to score within CONNECT_MEMORY_BUDGET_MB
+    """
+    chunk_size = max(1, CONNECT_MEMORY_BUDGET_MB * 1024 * 1024 // BYTES_PER_PAIR)
+    return [(pairs[start:start + chunk_size, 0], pairs[start:start + chunk_size, 1]) for start in range(0, len(pairs), chunk_size)]
+
+
+def _score_pairs_of_sides(rows, columns, keep_all=False):
+    """
+    Scores side rows[k] against side columns[k] both ways, for each k
+    Returns (rows, columns, errors, errors_reversed) like _score_pairs, for the pairs under the error ceiling (or all of them if `keep_all`)
+    """
+    errors, errors_reversed = _errors_between_sides(_tensor, rows, columns)
+    if keep_all:
+        return rows, columns, errors, errors_reversed
+    return _below_ceiling(rows, columns, errors, errors_reversed)
+
+
+def _below_ceiling(rows, columns, errors, errors_reversed):
+    keep = np.minimum(errors, errors_reversed) <= _error_ceiling()
+    return rows[keep], columns[keep], errors[keep], errors_reversed[keep]
+
+
+def _errors_between_sides(t, rows, columns, reverse=True):
+    """
+    Scores the sides in `rows` against the sides in `columns` (arrays of flat side indices, see _sides_by_length), all at once.
+    The two broadcast against each other, so they can be matching lists of pairs, or a column and a row to score every combination
+    Returns the error when each row side plugs into its column side, and the reverse (or None if not `reverse`),
+    with 1000 wherever they can't fit (sides of the same piece, lengths too different)
+    """
+    vertices = t.vertices.reshape(-1, SideTensor.VERTEX_COUNT, 2)
+    row_vertices, column_vertices = vertices[rows], vertices[columns]
+    column_vertices_flipped = t.vertices_flipped.reshape(-1, SideTensor.VERTEX_COUNT, 2)[columns]
+    length, other_length = t.length.reshape(-1)[rows], t.length.reshape(-1)[columns]
+    v_length, other_v_length = t.v_length.reshape(-1)[rows], t.v_length.reshape(-1)[columns]
+    same_piece = rows // 4 == columns // 4
+
+    # every pairwise difference between the row vertices and the column flipped vertices, (..., VERTEX_COUNT, 2)
+    differences = row_vertices - column_vertices_flipped
+    errors = util.error_between_differences(differences, p1_len=other_v_length)[0]
+    errors[same_piece | ~sides.is_similar_length(length, other_length)] = 1000
+    if not reverse:
+        return errors, None
+
+    # see sides.errors_when_fit_both_ways for why the reverse is just an offset away
+    differences[..., 0] += (np.max(column_vertices[..., 0], axis=-1) - np.max(row_vertices[..., 0], axis=-1))[..., np.newaxis]
+    errors_reversed = util.error_between_differences(differences, p1_len=v_length)[0]
+    errors_reversed[same_piece | ~sides.is_similar_length(other_length, length)] = 1000
+    return errors, errors_reversed
+
+
+def _check_solution(t, piece_ids, scored):
+    """
+    For the side-matches listed in SOLUTION, scores each direction on its own, shows how they line up,
+    and makes sure the batched scoring found the same errors
+    """
+    found = {}
+    for (i, si, j, sj, error) in _matches(*scored):
+        found[(piece_ids[i], si, piece_ids[j], sj)] = error
+
+    index_of = {piece_id: i for i, piece_id in enumerate(piece_ids)}
+    for s in SOLUTION:
+        if s[1] is None:
+            continue
+        (piece_id, si), (other_piece_id, sj) = s
+        debug_str = f'{piece_id}[{si}] vs {other_piece_id}[{sj}]'
+        matched = False
+        for (a, sa, b, sb) in [(piece_id, si, other_piece_id, sj), (other_piece_id, sj, piece_id, si)]:
+            i, j = index_of[a], index_of[b]
+            if not sides.is_similar_length(t.length[i, sa], t.length[j, sb]):
+                continue
+            expected, shift = util.error_between_polylines(t.vertices[i, sa], t.vertices_flipped[j, sb], p1_len=t.v_length[j, sb])
+            if expected <= sides.SIDE_MAX_ERROR_TO_MATCH:
+                print(f'{a}[{sa}] vs {b}[{sb}]')
+                print(f"\t ==> Error = {expected}, shift: {shift}")
+                util.render_polylines([t.vertices[i, sa] - shift, t.vertices_flipped[j, sb]])
+                matched = True
+            got = found.get((a, sa, b, sb), 1000)
+            if abs(min(got, 1000) - min(expected, 1000)) > sides.SIDE_SYMMETRY_TOLERANCE and min(got, expected) <= sides.SIDE_MAX_ERROR_TO_MATCH:
+                raise ValueError(f"Batched scoring gave {got} but scoring one way gave {expected}: {a}[{sa}] vs {b}[{sb}]")
+        if not matched:
+            raise ValueError(f"Should have matched but didn't: {debug_str}")
+
+
+def _keep_best_matches(piece, debug=False):
+    """
+    Sorts each side's matches best first, and drops any that are much worse than the best one
+    """
+    piece_id = piece.id
+    for si, side in enumerate(piece.sides):
+        if side.is_edge:
+            continue
 
         # make sure we have at least one match
         if len(piece.fits[si]) == 0:
@@ -82,12 +430,9 @@ def _find_potential_matches_for_piece(ps, piece_id, debug=False):
                 nth_match_error = piece.fits[si][nth - 1][2]
                 print(f"\t1st match error: {least_error} \t ==> {nth}th match error: {nth_match_error} \t ==> ratio: {nth_match_error / least_error}")
 
-    return (piece_id, piece)
-
 
 def _save(pieces, out_directory):
-    out = { p_id: p.to_dict() for (p_id, p) in pieces.items() }
-    path = os.path.join(out_directory, 'connectivity.json')
-    with open(path, 'w') as f:
-        json.dump(out, f)
+    # in the same order fit_graph.load gives them back, so the solver sees the same graph whether or not it comes straight from here
+    out = { p_id: pieces[p_id].to_dict() for p_id in sorted(pieces.keys()) }
+    fit_graph.save(fit_graph.path_for(out_directory), out)
     return out
\ No newline at end of file
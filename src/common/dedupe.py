@@ -4,9 +4,8 @@ import numpy as np
 import math
 from glob import glob
 import shutil
-from pathlib import Path
 
-from common import util, sides
+from common import piece_store, util, sides
 from common.config import *
 
 
@@ -24,26 +23,22 @@ def deduplicate(batch_data_path, input_path, output_path):
     print(f"Loading piece data from {input_path}...")
     pieces = {}
     piece_photo_locations = {}
-    input_path = Path(input_path)
-    for path in input_path.glob("side_*_0.json"):
-        i = int(path.parts[-1].split('_')[1])
+    stored = piece_store.load(input_path)
+    for i, data in stored.items():
         piece = []
         for j in range(4):
-            json_path = input_path.joinpath(f'side_{i}_{j}.json')
-            with open(json_path) as f:
-                data = json.load(f)
-                side = sides.Side(i, j, data['vertices'], piece_center=data['piece_center'],
-                                  is_edge=data['is_edge'], resample=True, rotate=False,
-                                  photo_filename=data['original_photo_name'])
-                piece.append(side)
-
-                # we'll also want to know where in the photo frame this piece was
-                piece_photo_locations[i] = {
-                    'photo_width': data['photo_width'],
-                    'photo_height': data['photo_height'],
-                    # we use centroids because they are generally quite stable between different photos of identical pieces
-                    'photo_space_centroid': data['photo_space_centroid'],
-                }
+            side = sides.Side(i, j, data['vertices'][j], piece_center=data['piece_center'],
+                              is_edge=data['is_edge'][j], resample=True, rotate=False,
+                              photo_filename=data['original_photo_name'])
+            piece.append(side)
+
+        # we'll also want to know where in the photo frame this piece was
+        piece_photo_locations[i] = {
+            'photo_width': data['photo_width'],
+            'photo_height': data['photo_height'],
+            # we use centroids because they are generally quite stable between different photos of identical pieces
+            'photo_space_centroid': data['photo_space_centroid'],
+        }
         pieces[i] = piece
 
     # open the metadata that tells us where each piece was photographed
@@ -107,11 +102,8 @@ def deduplicate(batch_data_path, input_path, output_path):
     print(f"Started with {len(pieces)}; found {len(dupes)} duplicate pieces; resulting in {len(uniques)} unique pieces.")
 
     # finally, copy all the uniques to the output directory
+    piece_store.save(output_path, {id: stored[id] for id in uniques})
     for id in uniques:
-        # copy the json files
-        for i in range(4):
-            side_i = f'side_{id}_{i}.json'
-            shutil.copyfile(os.path.join(input_path, side_i), os.path.join(output_path, side_i))
         # copy the vector file as well
         vector_filename = glob(f"{id}_*.svg", root_dir=input_path)[0] # Take the 0th element, there should be exactly 1
         input_vector_file = os.path.join(input_path, vector_filename)
@@ -0,0 +1,78 @@
+"""
+An on-disk cache of the raw errors between pairs of sides, so rerunning step 5 with different thresholds
+only has to re-filter errors we've already computed rather than score every pair of sides again,
+and adding or re-photographing a few pieces only means scoring the pairs of sides they're in
+
+Sides are addressed by a hash of their geometry (see side_keys), and each cache file by a hash of the parameters
+that went into scoring, so a cache entry can never be mistaken for one computed from a different side or setting
+"""
+
+import os
+import hashlib
+
+import numpy as np
+
+
+# bump this if the way we score pairs of sides changes
+VERSION = 2
+
+
+def side_keys(data, piece_ids):
+    """
+    A key for each side, in flat order (piece index * 4 + side index): a hash of which piece and side it is,
+    and everything we know about its shape (its row of `data`, a (pieces, 4, columns) array, see connect.SideTensor)
+    """
+    keys = []
+    for i, piece_id in enumerate(piece_ids):
+        for si in range(4):
+            h = hashlib.blake2b(digest_size=16)
+            h.update(f'{piece_id}:{si}:'.encode())
+            h.update(np.ascontiguousarray(data[i, si]).tobytes())
+            keys.append(h.hexdigest())
+    return keys
+
+
+def path_for(cache_path, params):
+    digest = hashlib.blake2b(f'{VERSION}:{params}'.encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_path, f'pair_errors_{digest}.npz')
+
+
+def save(cache_path, params, keys, rows, columns, errors, errors_reversed) -> None:
+    """
+    Writes the errors between side rows[k] and side columns[k] (flat side indices into `keys`), both ways
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    path = path_for(cache_path, params)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            keys=np.array(keys),
+            rows=np.asarray(rows, dtype=np.int32),
+            columns=np.asarray(columns, dtype=np.int32),
+            errors=np.asarray(errors, dtype=np.float64),
+            errors_reversed=np.asarray(errors_reversed, dtype=np.float64),
+        )
+    # swap it in all at once, so getting killed mid-write never leaves us with a corrupt cache
+    os.replace(tmp_path, path)
+
+
+def load(cache_path, params, keys):
+    """
+    Reads back the errors saved with the same `params` as (rows, columns, errors, errors_reversed, new), with rows and columns
+    as flat indices into `keys` and `new` a mask of the sides that were never scored (added, or changed shape since),
+    or returns None if there's no cache. Pairs with a side that has since been removed are dropped
+    """
+    path = path_for(cache_path, params)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        cached_keys = data['keys'].tolist()
+        index_of = {key: i for i, key in enumerate(keys)}
+        new = ~np.isin(np.array(keys), data['keys'])
+
+        remap = np.array([index_of.get(key, -1) for key in cached_keys], dtype=np.int64)
+        rows, columns = remap[data['rows']], remap[data['columns']]
+        keep = (rows >= 0) & (columns >= 0)
+        return rows[keep], columns[keep], data['errors'][keep], data['errors_reversed'][keep], new
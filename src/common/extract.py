@@ -1,44 +1,133 @@
 import os
 import re
-import subprocess
+import sys
+import ctypes
+import hashlib
 import pathlib
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from PIL import Image
 
 from common.config import *
 
 
-def batch_extract(input_path, output_path, scale_factor):
-    # just-in-time compile the C library to find islands
-    source_file = pathlib.Path(os.path.join(os.path.dirname(__file__), '../c/find_islands.c'))
-    cmd = fr"gcc -pthread -O3 -march=native -funroll-loops -ffast-math -o find_islands.o '{source_file}'"
-    print(cmd)
-    try:
-        subprocess.run(cmd, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error compiling: {e}")
-        exit(1)
+SOURCE_PATH = pathlib.Path(os.path.join(os.path.dirname(__file__), '../c/find_islands.c'))
+BUILD_PATH = pathlib.Path(os.path.join(os.path.dirname(__file__), '../c/build'))
+COMPILE_FLAGS = ['-O3', '-march=native', '-funroll-loops', '-ffast-math', '-shared', '-fPIC']
+
+_library = None
+
 
-    # invoke the C library to find islands
+class Island(ctypes.Structure):
+    # mirrors the Island struct in find_islands.c
+    _fields_ = [
+        ('rows', ctypes.c_int),
+        ('cols', ctypes.c_int),
+        ('origin_x', ctypes.c_int),  # the row of the island's top left corner in the photo
+        ('origin_y', ctypes.c_int),  # the column of the island's top left corner in the photo
+        ('matrix', ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+
+def batch_extract(input_path, output_path, scale_factor, threads=None):
+    """
+    Extracts every piece from every photo bitmap in the input directory into its own bitmap in the output directory
+    Returns a dict of each piece's filename => where it is in the original photo
+
+    threads: how many photos to work on at once (the C library releases the GIL while it works), by default one per CPU
+    """
     input_path = pathlib.Path(input_path)
     output_path = pathlib.Path(output_path)
-    cmd = fr".{os.path.sep}find_islands.o '{input_path}' '{output_path}' {MIN_PIECE_AREA}"
-    print(cmd)
-    try:
-        subprocess.run(cmd, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running extract lib: {e}")
-        exit(1)
+    _load_library()  # before we start any threads
 
-    output_photo_space_positions = {}
+    # biggest photos first, so we don't end up waiting on one big photo at the end while every other thread sits idle
+    fs = [f for f in os.listdir(input_path) if re.match(r'.*\.bmp', f)]
+    fs = sorted(fs, key=lambda f: os.path.getsize(input_path.joinpath(f)), reverse=True)
 
-    fs = [f for f in os.listdir(output_path) if re.match(r'.*\.bmp', f)]
-    for f in fs:
-        components = f.split('.')[0].split('_')
-        origin_component = components[-1]
-        origin_x, origin_y = origin_component.strip('(').strip(')').split(',')
-        origin = (int(origin_x), int(origin_y))
+    with ThreadPool(processes=threads or os.cpu_count()) as pool:
+        # one photo at a time, so each thread picks up the next photo as soon as it's free
+        extracted = list(pool.imap(lambda f: _extract(input_path, output_path, f), fs, chunksize=1))
 
-        photo_space_position = (origin[0] / scale_factor + CROP_TOP_RIGHT_BOTTOM_LEFT[-1], origin[1] / scale_factor + CROP_TOP_RIGHT_BOTTOM_LEFT[0])
-        output_photo_space_positions[f] = photo_space_position
-        print(f"Extracted {f} at {photo_space_position}, origin {origin}")
+    output_photo_space_positions = {}
+    for islands in extracted:
+        for f, origin in islands:
+            photo_space_position = (origin[0] / scale_factor + CROP_TOP_RIGHT_BOTTOM_LEFT[-1], origin[1] / scale_factor + CROP_TOP_RIGHT_BOTTOM_LEFT[0])
+            output_photo_space_positions[f] = photo_space_position
+            print(f"Extracted {f} at {photo_space_position}, origin {origin}")
 
     return output_photo_space_positions
+
+
+def find_islands(pixels):
+    """
+    Cleans up a binary photo, (rows, cols) of 1s and 0s with 1 = piece, and finds every piece in it
+    Returns a list of (pixels, origin) for each piece, with origin the (x, y) of the piece's top left corner in the photo
+    """
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8).copy()  # the library cleans up the photo in place
+    rows, cols = pixels.shape
+    library = _load_library()
+
+    islands = ctypes.POINTER(ctypes.POINTER(Island))()
+    num_islands = library.extract_islands(pixels.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8)), rows, cols, MIN_PIECE_AREA, ctypes.byref(islands))
+    try:
+        found = []
+        for i in range(num_islands):
+            island = islands[i].contents
+            mask = np.ctypeslib.as_array(island.matrix, shape=(island.rows, island.cols)).copy()
+            found.append((mask, (island.origin_y, island.origin_x)))
+        return found
+    finally:
+        library.free_islands(islands, num_islands)
+
+
+def _extract(input_path, output_path, f):
+    print(f"Extracting from {input_path.joinpath(f)}")
+    with Image.open(input_path.joinpath(f)) as img:
+        pixels = np.asarray(img) > 0
+
+    islands = []
+    for mask, origin in find_islands(pixels):
+        # the piece's origin goes in its filename, so we can tell where it was in the photo at a glance
+        island_f = f"{f[:-len('.bmp')]}_({origin[0]},{origin[1]}).bmp"
+        rows, cols = mask.shape
+        Image.frombytes('1', (cols, rows), np.packbits(mask, axis=1).tobytes()).save(output_path.joinpath(island_f))
+        islands.append((island_f, origin))
+    return islands
+
+
+def _load_library():
+    """
+    Loads find_islands.c as a shared library, compiling it the first time we see this version of the source
+    """
+    global _library
+    if _library is not None:
+        return _library
+
+    with open(SOURCE_PATH, 'rb') as f:
+        source = f.read()
+    digest = hashlib.blake2b(source + ' '.join(COMPILE_FLAGS).encode(), digest_size=8).hexdigest()
+    suffix = {'win32': '.dll', 'darwin': '.dylib'}.get(sys.platform, '.so')
+    library_path = BUILD_PATH.joinpath(f'find_islands_{digest}{suffix}')
+
+    if not library_path.exists():
+        os.makedirs(BUILD_PATH, exist_ok=True)
+        # build it under a temporary name and swap it in, so another run never loads a half-written library
+        tmp_path = BUILD_PATH.joinpath(f'find_islands_{digest}.{os.getpid()}.tmp')
+        cmd = ['gcc', *COMPILE_FLAGS, '-o', str(tmp_path), str(SOURCE_PATH)]
+        print(' '.join(cmd))
+        try:
+            subprocess.run(cmd, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f"Error compiling: {e}")
+            exit(1)
+        os.replace(tmp_path, library_path)
+
+    library = ctypes.CDLL(str(library_path))
+    library.extract_islands.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(Island)))]
+    library.extract_islands.restype = ctypes.c_int
+    library.free_islands.argtypes = [ctypes.POINTER(ctypes.POINTER(Island)), ctypes.c_int]
+    library.free_islands.restype = None
+    _library = library
+    return library
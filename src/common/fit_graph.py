@@ -0,0 +1,69 @@
+"""
+A compact binary format for the connectivity graph that step 5 hands to step 6
+
+Rather than nested lists, the graph is stored CSR-style as flat arrays in an .npz: the fits for side `si` of the k-th piece
+are entries offsets[4k + si] to offsets[4k + si + 1] of `neighbors` (the other piece's id), `neighbor_sides` (which of its sides)
+and `errors` (as stored in connectivity.json: the fit error * 1000, see pieces.Piece.to_dict), in the order connect.py sorted them
+"""
+
+import os
+import gc
+
+import numpy as np
+
+
+FILENAME = 'connectivity.npz'
+
+# bump this if the layout of the arrays below changes
+VERSION = 1
+
+
+def path_for(directory):
+    return os.path.join(directory, FILENAME)
+
+
+def save(path, graph) -> None:
+    """
+    Writes `graph`, a dict of piece_id => for each side, a list of (other_piece_id, other_side_index, error)
+    """
+    piece_ids = sorted(graph.keys())
+    fits = [fit for piece_id in piece_ids for fits_i in graph[piece_id] for fit in fits_i]
+    counts = [len(fits_i) for piece_id in piece_ids for fits_i in graph[piece_id]]
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        # uncompressed, so loading is just a read straight into the arrays
+        np.savez(
+            f,
+            version=np.array([VERSION], dtype=np.int64),
+            piece_ids=np.array(piece_ids, dtype=np.int32),
+            offsets=np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]),
+            neighbors=np.array([fit[0] for fit in fits], dtype=np.int32),
+            neighbor_sides=np.array([fit[1] for fit in fits], dtype=np.int8),
+            errors=np.array([fit[2] for fit in fits], dtype=np.float32),
+        )
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """
+    Reads back a graph saved by `save`, in the same shape: piece_id => for each side, a list of (other_piece_id, other_side_index, error)
+    """
+    with np.load(path) as data:
+        if int(data['version'][0]) != VERSION:
+            raise Exception(f"{path} was saved by a different version of the solver, rerun step 5")
+        piece_ids = data['piece_ids'].tolist()
+        offsets = data['offsets'].tolist()
+        neighbors, neighbor_sides, errors = data['neighbors'].tolist(), data['neighbor_sides'].tolist(), data['errors'].tolist()
+
+    # nothing we make here can be garbage, and with thousands of pieces the collector would otherwise
+    # spend about as long scanning all these new tuples as it takes to make them
+    gc.disable()
+    try:
+        fits = list(zip(neighbors, neighbor_sides, errors))
+        graph = {}
+        for k, piece_id in enumerate(piece_ids):
+            graph[piece_id] = [fits[offsets[4 * k + si]:offsets[4 * k + si + 1]] for si in range(4)]
+    finally:
+        gc.enable()
+    return graph
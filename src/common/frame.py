@@ -0,0 +1,99 @@
+"""
+Solves the puzzle's frame on its own, before searching the interior
+
+Only the 2 * (W + H) - 4 edge pieces can go around the border, so we find an ordering of them that
+walks clockwise from the top left corner and plugs back into it (a Hamiltonian cycle over the edge pieces,
+with corners landing exactly where the known side lengths put them). The interior search then starts
+from a fully constrained boundary
+"""
+
+from common import board, propagate
+from common.config import *
+
+
+# give up on a corner after trying this many edge piece placements while looking for frames
+MAX_ITERATIONS_TO_FIND_FRAME = 250000
+
+# hand at most this many different frames to the interior search before giving up on a corner
+MAX_FRAMES_TO_TRY = 10
+
+# print the board every this many placements
+PROGRESS_INTERVAL = 1000
+
+
+def ring(width, height):
+    """
+    The border cells, clockwise from the top left corner
+    """
+    cells = [(x, 0) for x in range(width)]
+    cells += [(width - 1, y) for y in range(1, height)]
+    cells += [(x, height - 1) for x in range(width - 2, -1, -1)]
+    cells += [(0, y) for y in range(height - 2, 0, -1)]
+    return cells
+
+
+def find_frames(index, start_piece_id):
+    """
+    Depth-first search around the border that yields each complete frame it finds,
+    as a list of (x, y, piece_id, orientation) placements in clockwise order
+
+    We track candidate domains as we go (see propagate.py), so a frame is abandoned as soon as it leaves
+    a border or interior cell with nothing that fits, e.g. when no edge piece is left that could close the loop
+    """
+    cells = ring(PUZZLE_WIDTH, PUZZLE_HEIGHT)
+    b = board.Board(width=PUZZLE_WIDTH, height=PUZZLE_HEIGHT, index=index)
+    domains = propagate.Domains(b)
+    start_orientation = board._orient_start_corner_to_top_left(index.fits[start_piece_id])
+    if not domains.assign(0, 0, start_piece_id, start_orientation):
+        return
+    placements = [(0, 0, start_piece_id, start_orientation)]
+
+    # each stack entry is a ring position we're filling in: [index into cells, candidates, index of the next candidate to try, trail length before we tried any]
+    stack = [[1, domains.candidates(*cells[1]), 0, len(domains.trail)]]
+
+    iteration = 0
+    while stack:
+        top = stack[-1]
+        k, candidates, i, mark = top
+        domains.rewind(mark)
+        del placements[k:]
+        if i >= len(candidates):
+            stack.pop()
+            continue
+        top[2] += 1
+
+        iteration += 1
+        if iteration % PROGRESS_INTERVAL == 0:
+            print("\n" * 40)
+            print(f"Frame iteration {iteration} with length {b.placed_count} of {len(cells)}")
+            print(b)
+            if iteration > MAX_ITERATIONS_TO_FIND_FRAME:
+                raise Exception(f"Too many iterations looking for a frame from corner {start_piece_id}")
+
+        piece_id, orientation = candidates[i]
+        x, y = cells[k]
+        if not domains.assign(x, y, piece_id, orientation):
+            continue
+        placements.append((x, y, piece_id, orientation))
+
+        if k == len(cells) - 1:
+            yield list(placements)
+        else:
+            stack.append([k + 1, domains.candidates(*cells[k + 1]), 0, len(domains.trail)])
+
+
+def build_from_corner(build_fn, index, start_piece_id, edge_length):
+    """
+    Finds frames around the border from the given corner, and hands each one to `build_fn`
+    (board.build_from_corner or propagate.build_from_corner) to fill in the interior
+    """
+    print(f"\n===============================\nFinding frames from corner {start_piece_id}...")
+    for i, placements in enumerate(find_frames(index, start_piece_id)):
+        print(f"Found frame #{i + 1} from corner {start_piece_id}, searching the interior...")
+        try:
+            return build_fn(index, start_piece_id=start_piece_id, edge_length=edge_length, border=placements)
+        except Exception as e:
+            print(f"Frame #{i + 1} did not lead to a solution: {e}")
+        if i + 1 >= MAX_FRAMES_TO_TRY:
+            break
+    raise Exception(f"No frame from corner {start_piece_id} led to a solution")
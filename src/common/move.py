@@ -2,7 +2,7 @@ import os
 import json
 import math
 
-from common import util
+from common import piece_store, util
 from common.config import *
 
 
@@ -45,6 +45,8 @@ def move_pieces_into_place(puzzle, metadata_path, output_path):
     # as we spiral around, we make sure each ring of the spiral is a perfect rectangle
     spiral_width, spiral_height = (0, 0)
 
+    stored = piece_store.load(metadata_path)
+
     for i in range(puzzle.width * puzzle.height):
         piece_id, _, orientation = puzzle.get(x, y)
         print(f"> Placing Piece {piece_id} in spot [{x}, {y}], in orientation {orientation}")
@@ -71,11 +73,8 @@ def move_pieces_into_place(puzzle, metadata_path, output_path):
         neighbor_below_angle = util.angle_between(neighbor_below[0], neighbor_below[-1]) % (2 * math.pi) if neighbor_below else None
         neighbor_left_angle = util.angle_between(neighbor_left[0], neighbor_left[-1]) % (2 * math.pi) if neighbor_left else None
 
-        # load our piece's side data
-        sides = []
-        for i in range(4):
-            with open(os.path.join(metadata_path, f'side_{piece_id}_{i}.json'), 'r') as f:
-                sides.append(json.load(f))
+        # our piece's side data, each side with the piece's metadata
+        sides = [dict(stored[piece_id], vertices=vertices.tolist()) for vertices in stored[piece_id]['vertices']]
 
         # what angle is each side currently at?
         side_angles = []
@@ -0,0 +1,94 @@
+"""
+Stores every piece's sides and metadata for steps 3 through 6 in a handful of files, rather than a JSON file per side
+
+The vertices of every side of every piece live back to back in one array that we memory-map when loading,
+with an offset index into it: side `si` of the k-th piece is vertices[offsets[4k + si]:offsets[4k + si + 1]].
+Everything else about each piece (where it was photographed, its incenter, which sides are edges, ...) goes in one JSON table
+"""
+
+import os
+import json
+from pathlib import Path
+
+import numpy as np
+
+
+VERTICES_FILENAME = 'pieces_vertices.npy'
+OFFSETS_FILENAME = 'pieces_offsets.npy'
+INDEX_FILENAME = 'pieces.json'
+
+# bump this if the layout of the files above changes
+VERSION = 1
+
+
+def exists(directory) -> bool:
+    return os.path.exists(os.path.join(directory, INDEX_FILENAME))
+
+
+def save(directory, pieces) -> None:
+    """
+    Writes `pieces`, a dict of piece_id => piece, where a piece is a dict of its metadata
+    plus 'vertices', a list of each side's vertices, and 'is_edge', a list of whether each side is an edge
+    """
+    piece_ids = sorted(pieces.keys())
+    sides = [np.asarray(vertices, dtype=np.int32).reshape(-1, 2) for piece_id in piece_ids for vertices in pieces[piece_id]['vertices']]
+    index = {
+        'version': VERSION,
+        'piece_ids': piece_ids,
+        'is_edge': [[bool(e) for e in pieces[piece_id]['is_edge']] for piece_id in piece_ids],
+        'metadata': [{k: v for k, v in pieces[piece_id].items() if k not in ('vertices', 'is_edge')} for piece_id in piece_ids],
+    }
+
+    # the index goes last, so a reader never sees it pointing into vertices that haven't been written yet
+    _save_atomically(os.path.join(directory, VERTICES_FILENAME), lambda f: np.save(f, np.concatenate(sides) if sides else np.zeros((0, 2), dtype=np.int32)))
+    _save_atomically(os.path.join(directory, OFFSETS_FILENAME), lambda f: np.save(f, np.concatenate([[0], np.cumsum([len(s) for s in sides], dtype=np.int64)])))
+    _save_atomically(os.path.join(directory, INDEX_FILENAME), lambda f: f.write(json.dumps(index).encode()))
+
+
+def load(directory):
+    """
+    Reads back the pieces saved by `save`, in the same shape, with each side's vertices a read-only view into the memory-mapped array
+    Falls back to the side_{id}_{i}.json files that steps 3 and 4 used to write, so older runs can still be picked up part way through
+    """
+    index_path = os.path.join(directory, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return _load_side_jsons(directory)
+
+    with open(index_path, 'r') as f:
+        index = json.load(f)
+    if index['version'] != VERSION:
+        raise Exception(f"{index_path} was saved by a different version of the pipeline, rerun from step 3")
+    vertices = np.load(os.path.join(directory, VERTICES_FILENAME), mmap_mode='r')
+    offsets = np.load(os.path.join(directory, OFFSETS_FILENAME)).tolist()
+
+    pieces = {}
+    for k, piece_id in enumerate(index['piece_ids']):
+        piece = index['metadata'][k]
+        piece['vertices'] = [vertices[offsets[4 * k + si]:offsets[4 * k + si + 1]] for si in range(4)]
+        piece['is_edge'] = index['is_edge'][k]
+        pieces[piece_id] = piece
+    return pieces
+
+
+def _load_side_jsons(directory):
+    pieces = {}
+    for path in Path(directory).glob("side_*_0.json"):
+        piece_id = int(path.parts[-1].split('_')[1])
+        side_data = []
+        for si in range(4):
+            with open(os.path.join(directory, f'side_{piece_id}_{si}.json'), 'r') as f:
+                side_data.append(json.load(f))
+
+        piece = {k: v for k, v in side_data[0].items() if k != 'side_index'}
+        piece['vertices'] = [np.array(data['vertices']) for data in side_data]
+        piece['is_edge'] = [data['is_edge'] for data in side_data]
+        pieces[piece_id] = piece
+    return pieces
+
+
+def _save_atomically(path, write) -> None:
+    # swap each file in all at once, so getting killed mid-write never leaves a corrupt store behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
@@ -1,29 +1,24 @@
-import os
-import json
 import numpy as np
 
-from common import sides
+from common import piece_store, sides
 
 class Piece(object):
     @staticmethod
     def load_all(directory, resample=False):
         pieces = {}
-        for f in os.listdir(directory):
-            if not f.startswith("side_"):
-                continue
-            id = int(f.split("_")[1])
-            piece = Piece.load(directory, id=id, resample=resample)
+        for id, data in piece_store.load(directory).items():
+            piece = Piece.load(id, data, resample=resample)
             pieces[piece.id] = piece
         return pieces
 
     @classmethod
-    def load(cls, directory, id, resample):
+    def load(cls, id, data, resample):
+        """
+        Builds a piece from what the piece store has for it (see piece_store.py)
+        """
         sides_list = []
         for side_index in range(4):
-            path = os.path.join(directory, f"side_{id}_{side_index}.json")
-            with open(path, "r") as f:
-                data = json.load(f)
-            side = sides.Side(piece_id=id, side_id=side_index, vertices=np.array(data['vertices']), piece_center=data['piece_center'], is_edge=data['is_edge'], resample=resample)
+            side = sides.Side(piece_id=id, side_id=side_index, vertices=np.array(data['vertices'][side_index]), piece_center=data['piece_center'], is_edge=data['is_edge'][side_index], resample=resample)
             sides_list.append(side)
         piece = cls(id=id, is_edge=False, sides=sides_list)
         return piece
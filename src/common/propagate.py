@@ -0,0 +1,185 @@
+"""
+A constraint-propagating alternative to the spiral solver in board.py
+
+Every empty cell next to a placed piece keeps a domain: the (piece, orientation) candidates that
+fit all of its placed neighbors and line up with the border. Each placement prunes its neighbors'
+domains and removes the placed piece from every other domain (forward checking), so we back out of a
+branch as soon as any cell runs out of candidates instead of when the spiral physically reaches it.
+We always fill the cell with the fewest candidates next (minimum remaining values)
+"""
+
+from common import board
+from common.config import *
+
+
+# print the board every this many placements
+PROGRESS_INTERVAL = 1000
+
+
+class Domains(object):
+    """
+    The candidate domains of every empty cell that touches a placed piece, plus a trail of changes
+    so a branch can be rewound without copying anything
+    """
+    def __init__(self, b) -> None:
+        self.board = b
+        self.index = b.index
+
+        # (x, y) => {(piece_id, orientation): cumulative fit error with placed neighbors}
+        self.domains = {}
+
+        # piece_id => the cells whose domain mentions that piece
+        self.holders = {}
+
+        # undo log, each entry is either None for a placement, or (cell, domain it replaced)
+        self.trail = []
+
+    def assign(self, x, y, piece_id, orientation) -> bool:
+        """
+        Places the piece and propagates its constraints. Returns False if some cell is left without candidates,
+        in which case the caller must rewind to undo the partial update
+        """
+        self.board.place(piece_id, x, y, orientation)
+        self.trail.append(None)
+        if (x, y) in self.domains:
+            self._replace((x, y), None)
+
+        # narrow each empty neighbor down to the candidates that plug into the side we just placed facing it
+        for direction, (dx, dy) in board.NEIGHBOR_OFFSETS.items():
+            nx, ny = x + dx, y + dy
+            if not self.board.is_available(nx, ny):
+                continue
+            fitting = self._candidates_facing(piece_id, orientation, direction, nx, ny)
+            current = self.domains.get((nx, ny))
+            if current is None:
+                narrowed = fitting
+            else:
+                narrowed = {c: current[c] + error for c, error in fitting.items() if c in current}
+            self._replace((nx, ny), narrowed)
+            if not narrowed:
+                return False
+
+        # every piece only goes in one place
+        for cell in list(self.holders.get(piece_id, ())):
+            narrowed = {c: error for c, error in self.domains[cell].items() if c[0] != piece_id}
+            self._replace(cell, narrowed)
+            if not narrowed:
+                return False
+        return True
+
+    def rewind(self, mark) -> None:
+        """
+        Undoes placements and domain changes until the trail is `mark` entries long
+        """
+        while len(self.trail) > mark:
+            entry = self.trail.pop()
+            if entry is None:
+                self.board.undo()
+                continue
+            cell, domain = entry
+            self._set(cell, domain)
+
+    def most_constrained(self):
+        """
+        Returns the cell with the fewest remaining candidates, and its candidates ordered best fit first
+        """
+        (x, y), domain = min(self.domains.items(), key=lambda item: (len(item[1]), item[0][1], item[0][0]))
+        return x, y, self.candidates(x, y)
+
+    def candidates(self, x, y):
+        """
+        The (piece_id, orientation) pairs that can still go at (x, y), ordered best fit first
+        """
+        domain = self.domains.get((x, y), {})
+        return sorted(domain, key=lambda c: (domain[c], c))
+
+    def _candidates_facing(self, piece_id, orientation, direction, x, y):
+        side_index = (direction - orientation) % 4
+        facing = board.OPPOSITE[direction]
+        required_edges = self.board.edge_mask(x, y)
+        candidates = {}
+        for other_piece_id, other_side_index, error in self.index.fits[piece_id][side_index]:
+            other_orientation = (facing - other_side_index) % 4
+            if self.board.is_placed(other_piece_id):
+                continue
+            if self.index.edge_masks[other_piece_id][other_orientation] != required_edges:
+                continue
+            # the fit has to be listed from both sides, just like Board.can_place requires
+            if (piece_id, side_index) not in self.index.pairs[other_piece_id][other_side_index]:
+                continue
+            candidates[(other_piece_id, other_orientation)] = error
+        return candidates
+
+    def _replace(self, cell, domain):
+        self.trail.append((cell, self.domains.get(cell)))
+        self._set(cell, domain)
+
+    def _set(self, cell, domain):
+        old_pieces = set([c[0] for c in self.domains.get(cell, ())])
+        new_pieces = set([c[0] for c in domain or ()])
+        for piece_id in old_pieces - new_pieces:
+            self.holders[piece_id].discard(cell)
+        for piece_id in new_pieces - old_pieces:
+            self.holders.setdefault(piece_id, set()).add(cell)
+
+        if domain is None:
+            del self.domains[cell]
+        else:
+            self.domains[cell] = domain
+
+
+def build_from_corner(index, start_piece_id, edge_length, border=None):
+    """
+    Depth-first search that starts with the corner in the top left, then repeatedly fills in the most constrained cell
+    If `border` is given, it is a list of (x, y, piece_id, orientation) placements around the border (see frame.py)
+    that are fixed in place before we search the interior
+    """
+    print(f"\n===============================\nPropagating from corner {start_piece_id}...")
+    if border is None:
+        border = [(0, 0, start_piece_id, board._orient_start_corner_to_top_left(index.fits[start_piece_id]))]
+
+    b = board.Board(width=PUZZLE_WIDTH, height=PUZZLE_HEIGHT, index=index)
+    domains = Domains(b)
+    for (x, y, piece_id, orientation) in border:
+        if not domains.assign(x, y, piece_id, orientation):
+            raise Exception(f"Placing {piece_id} at ({x}, {y}) leaves a neighboring cell with no candidates")
+    if b.placed_count == PUZZLE_WIDTH * PUZZLE_HEIGHT:
+        return b
+
+    # each stack entry is a cell we're filling in: [x, y, candidates, index of the next candidate to try, trail length before we tried any]
+    x, y, candidates = domains.most_constrained()
+    stack = [[x, y, candidates, 0, len(domains.trail)]]
+
+    nodes = 0
+    longest = 0
+    while stack:
+        top = stack[-1]
+        x, y, candidates, i, mark = top
+        domains.rewind(mark)
+        if i >= len(candidates):
+            stack.pop()
+            continue
+        top[3] += 1
+        piece_id, orientation = candidates[i]
+
+        nodes += 1
+        if nodes % PROGRESS_INTERVAL == 0:
+            print("\n" * 40)
+            print(f"Node {nodes} with length {b.placed_count}, depth {len(stack)}, longest: {longest}")
+            print(b)
+            if nodes > board.MAX_ITERATIONS:
+                raise Exception(f"Too many nodes, longest found: {longest}")
+
+        if not domains.assign(x, y, piece_id, orientation):
+            continue
+
+        longest = max(longest, b.placed_count)
+        if b.placed_count == PUZZLE_WIDTH * PUZZLE_HEIGHT:
+            print(f"Found solution after {nodes} nodes!")
+            print(b)
+            return b
+
+        x, y, candidates = domains.most_constrained()
+        stack.append([x, y, candidates, 0, len(domains.trail)])
+
+    raise Exception(f"No solution found after {nodes} nodes, longest found: {longest}")
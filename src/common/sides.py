@@ -14,6 +14,13 @@ SIDE_MAX_LENGTH_DISCREPANCY = 0.08
 # when we resample a side, we use this many vertices
 SIDE_RESAMPLE_VERTEX_COUNT = 26
 
+# scoring a pair of sides both ways at once agrees with scoring each way separately to within this
+# (they can only differ by floating point rounding, since vertices and vertices_flipped are rotated separately)
+SIDE_SYMMETRY_TOLERANCE = 1e-6
+
+# how many of the lowest frequencies (each way) of a side's outline go into its shape descriptor
+SIDE_DESCRIPTOR_HARMONICS = 4
+
 
 class Side(object):
     def __init__(self, piece_id, side_id, vertices, piece_center, is_edge, resample=False, rotate=True, photo_filename=None) -> None:
@@ -55,6 +62,12 @@ class Side(object):
     def length(self) -> float:
         return util.distance(self.p1, self.p2)
 
+    def is_similar_length_to(self, side) -> bool:
+        """
+        Whether this side is within SIDE_MAX_LENGTH_DISCREPANCY of the other side's length, measured relative to the other side
+        """
+        return is_similar_length(self.length, side.length)
+
     def error_when_fit_with(self, side, flip=True, render=False, skip_edges = True, debug_str=None) -> bool:
         """
         Returns None if no match, or a float representing the similarity of the two sides (1.0 = perfect) if they generally match
@@ -68,10 +81,9 @@ class Side(object):
             return 1000
 
         # sides must be roughly the same length
-        d_scale = 1.0 - (self.length / side.length)
-        if abs(d_scale) > SIDE_MAX_LENGTH_DISCREPANCY:
+        if not self.is_similar_length_to(side):
             # if render:
-            #     print(f"\tNO MATCH: scale is too different!!!!!!!!!! {d_scale}")
+            #     print(f"\tNO MATCH: scale is too different!!!!!!!!!! {1.0 - (self.length / side.length)}")
             return 1000
 
         polyline1 = self.vertices
@@ -90,27 +102,73 @@ class Side(object):
 
         return error
 
-    @staticmethod
-    def rotated(vertices, from_angle, desired_angle) -> List[Tuple[int, int]]:
+    def errors_when_fit_both_ways(self, side):
         """
-        Returns a list of vertices that have been geometrically rotated such that the side is at the desired angle, with p1 as the origin
+        Returns (self.error_when_fit_with(side), side.error_when_fit_with(self)) for the price of one comparison
         """
-        o = vertices[0]
+        if self.is_edge or side.is_edge:
+            return 1000, 1000
+        return errors_when_fit_both_ways(self.vertices, self.vertices_flipped, self.length, self.v_length, side.vertices, side.vertices_flipped, side.length, side.v_length)
 
-        # translate to origin
-        translated = []
-        for i, (x, y) in enumerate(vertices):
-            translated.append((x - o[0], y - o[1]))
+    @staticmethod
+    def rotated(vertices, from_angle, desired_angle) -> np.ndarray:
+        """
+        Returns an array of vertices that have been geometrically rotated such that the side is at the desired angle, with p1 as the origin
+        """
+        vertices = np.asarray(vertices, dtype=np.float64)
 
+        # translate to origin, then rotate around it
         angle_diff = desired_angle - from_angle
-        rotated = []
-
-        # rotate around the origin
-        for v in translated:
-            rotated.append(util.rotate(v, around=translated[0], angle=angle_diff))
+        cos, sin = math.cos(angle_diff), math.sin(angle_diff)
+        rotated = (vertices - vertices[0]) @ np.array([[cos, sin], [-sin, cos]])
 
         if desired_angle != 0:
-            min_x = min([v[0] for v in rotated])
-            rotated = [(v[0] - min_x, v[1]) for v in rotated]
-
-        return np.array(rotated)
+            rotated[:, 0] -= np.min(rotated[:, 0])
+
+        return rotated
+
+
+def is_similar_length(length, other_length) -> bool:
+    d_scale = 1.0 - (length / other_length)
+    return abs(d_scale) <= SIDE_MAX_LENGTH_DISCREPANCY
+
+
+def errors_when_fit_both_ways(vertices, vertices_flipped, length, v_length, other_vertices, other_vertices_flipped, other_length, other_v_length):
+    """
+    Scores how well two (non-edge) sides plug into each other, in both directions, from their resampled vertices and lengths
+    so that callers can keep sides packed in arrays rather than as Side objects (see connect.py)
+
+    Both directions compare the same two outlines, just turned half way around: a side's vertices_flipped is its vertices
+    rotated by pi and shifted to start at x = 0. So the differences the reverse comparison sees are the ones we see,
+    in reverse order and offset in x by the difference between those two shifts.
+    The error only depends on those differences (see util.error_between_differences), so we can score both from one subtraction
+    """
+    # the length check is relative to the side we compare against, so it can pass one way but not the other
+    fits = is_similar_length(length, other_length)
+    fits_reversed = is_similar_length(other_length, length)
+    if not fits and not fits_reversed:
+        return 1000, 1000
+
+    differences = vertices - other_vertices_flipped
+    error = util.error_between_differences(differences, p1_len=other_v_length)[0] if fits else 1000
+
+    offset = np.max(other_vertices[:, 0]) - np.max(vertices[:, 0])
+    error_reversed = util.error_between_differences(differences + (offset, 0), p1_len=v_length)[0] if fits_reversed else 1000
+    return error, error_reversed
+
+
+def descriptors(vertices):
+    """
+    Fixed-length shape descriptors for resampled sides, (..., VERTEX_COUNT, 2) => (..., 4 * SIDE_DESCRIPTOR_HARMONICS)
+
+    We treat each outline as a sequence of complex numbers x + iy around its centroid and keep its lowest frequencies,
+    which capture where the nub is, how deep and how wide, while ignoring pixel noise. By Parseval, the distance between
+    two descriptors approximates the distance between the outlines, so a side's vertices lands near the vertices_flipped
+    of the sides it plugs into
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    z = vertices[..., 0] + 1j * vertices[..., 1]
+    z = z - np.mean(z, axis=-1, keepdims=True)
+    f = np.fft.fft(z, axis=-1) / z.shape[-1]
+    f = np.concatenate([f[..., 1:SIDE_DESCRIPTOR_HARMONICS + 1], f[..., -SIDE_DESCRIPTOR_HARMONICS:]], axis=-1)
+    return np.concatenate([f.real, f.imag], axis=-1)
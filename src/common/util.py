@@ -24,6 +24,17 @@ BLACK_ON_BLUE = '\033[30;44m'
 BLACK_ON_RED = '\033[30;41m'
 BLACK_ON_GREEN = '\033[30;42m'
 
+# curve_score measures the angle at each point to the points this many away on either side
+CURVE_SCORE_GAP = 4
+
+# how far away a pixel can be and still make a difference to whether one round of remove_stragglers changes another:
+# a peninsula's center looks 2 pixels out (after stragglers and cracks, which look 1 pixel out), and clears 1 pixel around it
+STRAGGLER_CLEANUP_REACH = 4
+
+# once a round of remove_stragglers changes more than this fraction of the image, we look at every pixel in the next round
+# rather than just around the ones that changed
+STRAGGLER_CLEANUP_MAX_LOCAL_FRACTION = 0.002
+
 EXPECTED_PHOTO_ORIENTATION = 1 # Horizontal (normal)
 
 
@@ -204,29 +215,29 @@ def centroid(polygon):
     return (int(round(centroid.x)), int(round(centroid.y)))
 
 
-def incenter(polygon):
+def incenter(pixels, refine=True):
     """
-    Finds the point inside the polygon furthest from the edges.
+    Finds the point inside the piece furthest from the edges, given its binary pixel mask (1 = piece, indexed [y][x]).
     This should be the best area to grip the piece by.
+    That's the peak of the mask's Euclidean distance transform, which we place between pixels if `refine` is set,
+    by fitting a parabola through the peak and its neighbors along each axis
     """
-    polygon = Polygon(polygon)
+    # pad, so pixels on the edge of the bitmap count as touching the background
+    distances = ndimage.distance_transform_edt(np.pad(np.asarray(pixels) > 0, 1))[1:-1, 1:-1]
+    y, x = np.unravel_index(np.argmax(distances), distances.shape)
+    if not refine:
+        return (int(x), int(y))
 
-    c = polygon.centroid
-    search_radius = 0.25 * (polygon.bounds[2] - polygon.bounds[0])
-    stride = 8
-    minx, miny, maxx, maxy = c.x - search_radius, c.y - search_radius, c.x + search_radius, c.y + search_radius
-    points = np.array([Point(x, y) for x in range(int(minx), int(maxx), stride) for y in range(int(miny), int(maxy), stride)])
+    def _offset(before, peak, after):
+        curvature = before - 2 * peak + after
+        if curvature >= 0:
+            return 0.0
+        return min(max(0.5 * (before - after) / curvature, -0.5), 0.5)
 
-    max_distance = 0
-    incenter = None
-    for point in points:
-        if not polygon.contains(point):
-            continue
-        distance = polygon.exterior.distance(point)
-        if distance > max_distance:
-            max_distance = distance
-            incenter = point
-    return (int(round(incenter.x)), int(round(incenter.y)))
+    height, width = distances.shape
+    dx = _offset(distances[y, x - 1], distances[y, x], distances[y, x + 1]) if 0 < x < width - 1 else 0.0
+    dy = _offset(distances[y - 1, x], distances[y, x], distances[y + 1, x]) if 0 < y < height - 1 else 0.0
+    return (float(x + dx), float(y + dy))
 
 
 def intersection(line1, line2):
@@ -340,39 +351,52 @@ def mirrored(vertices) -> List[Tuple[int, int]]:
 def resample_polyline(polyline, n):
     """
     Given a polyline and a number of points to resample to,
-    returns a resampled polyline with n segments, each of equal length
+    returns a resampled polyline with n segments, each of equal length, as an (n + 1, 2) array, and the polyline's length
     """
-    line = LineString(polyline)
-    line_length = line.length
+    polyline = np.asarray(polyline, dtype=np.float64)
+
+    # how far along the line each vertex is, so we can interpolate each coordinate at evenly spaced distances along it
+    steps = np.sqrt(np.sum(np.diff(polyline, axis=0) ** 2, axis=1))
+    along = np.concatenate([[0.0], np.cumsum(steps)])
+    line_length = float(along[-1])
 
-    # Create n evenly spaced points along the line
-    # and a list of Points at those distances
     distances = np.linspace(0, line_length, n + 1)
-    points = [line.interpolate(distance) for distance in distances]
-    return [(float(point.x), float(point.y)) for point in points], line_length
+    points = np.stack([np.interp(distances, along, polyline[:, 0]), np.interp(distances, along, polyline[:, 1])], axis=1)
+    return points, line_length
 
 
 def error_between_polylines(polyline1, polyline2, p1_len):
     """
     Returns the total integrated error between two polylines
+
+    This isn't symmetric: we shift polyline1 onto polyline2 by how far it falls short of it on average (clamped in y),
+    so swapping the polylines can shift them differently, and the error is normalized by whatever length the caller passes.
+    It only depends on the pointwise differences between the polylines though (see error_between_differences)
     """
-    def _error_between_polylines(p1, p2):
-        differences = np.abs(p1 - p2)
-        error = np.sum(differences)
-        error_x, error_y = np.sum(differences - p1 + p2, axis=0) / len(p1)
-        return error, error_x, error_y
+    return error_between_differences(np.asarray(polyline1) - np.asarray(polyline2), p1_len)
+
+
+def error_between_differences(differences, p1_len):
+    """
+    Same as error_between_polylines, given polyline1 - polyline2 rather than the polylines themselves
+    `differences` can have any number of leading dimensions (broadcasting against `p1_len`) to score many pairs of polylines at once
+    """
+    def _error_between_differences(d):
+        abs_d = np.abs(d)
+        error = np.sum(abs_d, axis=(-2, -1))
+        shift = np.sum(abs_d - d, axis=-2) / d.shape[-2]
+        return error, shift
 
     # sample along the polylines at fixed intervals
-    error, error_x, error_y = _error_between_polylines(polyline1, polyline2)
+    error, shift = _error_between_differences(differences)
 
     # only allow a little bit of y shifting, up to +/- 5 pixels
-    error_y = max(-5, min(5, error_y))
+    shift[..., 1] = np.clip(shift[..., 1], -5, 5)
 
     # we often have slight alignment errors because of differences in corner shape
     # find the mean error, and shift by that amount, then recompute
-    polyline1_shifted = [(x - error_x, y - error_y) for (x, y) in polyline1]
-    error_shifted, _, _ = _error_between_polylines(polyline1_shifted, polyline2)
-    return min(error, error_shifted) / p1_len, (error_x, error_y)
+    error_shifted, _ = _error_between_differences(differences - shift[..., np.newaxis, :])
+    return np.minimum(error, error_shifted) / p1_len, (shift[..., 0], shift[..., 1])
 
 
 def distance_to_polyline(point, polyline):
@@ -559,7 +583,7 @@ def curve_score(points, debug=False) -> float:
     if len(points) < 16:
         raise Exception("Need a bunch of points to calculate curve score")
 
-    gap = 4
+    gap = CURVE_SCORE_GAP
     angles = [counterclockwise_angle_between_vectors(points[i - gap], points[i], points[i + gap]) for i in range(gap, len(points) - gap)]
     avg_angle = average_of_angles(angles)
     angle_deviations = [compare_angles(angle, avg_angle) for angle in angles]
@@ -795,8 +819,48 @@ def remove_stragglers(pixels):
     Also fills "cracks" that are a hairline wide of 0s surrounded by at least 6 pixels of 1s.
     Requires the input image to be padded with 0s around the border
     Returns True if any modifications were made.
+
+    We clean up in rounds until nothing changes. Whether a round changes a pixel only depends on the pixels within
+    STRAGGLER_CLEANUP_REACH of it, so after a first round over the whole image, each round only needs to look around
+    the pixels that the round before it changed
     """
+    # work on a copy with a wider border of 0s, so we can look as far as we need to from any pixel without leaving it
+    reach = STRAGGLER_CLEANUP_REACH
+    padded = np.pad(pixels, pad_width=reach, mode='constant', constant_values=0)
+    unpadded = padded[reach:-reach, reach:-reach]
+    padded_width = padded.shape[1]
+    work = padded.reshape(-1)
+
+    inside = np.zeros(padded.shape, dtype=bool)
+    inside[reach:-reach, reach:-reach] = True
+    core = np.zeros_like(inside)
+    core[reach + 1:-reach - 1, reach + 1:-reach - 1] = True  # stragglers and cracks are only cleaned up inside the padding
+    inside, core = inside.reshape(-1), core.reshape(-1)
+
     removed = False
+    changed = None
+    scratch = None
+    while changed is None or len(changed) > 0:
+        if changed is None or len(changed) > STRAGGLER_CLEANUP_MAX_LOCAL_FRACTION * work.size:
+            # with this much changing, it's quicker to look at every pixel again
+            changed = _clean_up_everywhere(unpadded)
+            changed = (changed // pixels.shape[1] + reach) * padded_width + (changed % pixels.shape[1] + reach)
+            scratch = None
+        else:
+            if scratch is None:
+                scratch = (work.copy(), np.zeros(work.shape, dtype=bool))
+            changed = _clean_up_around(work, padded_width, changed, inside, core, scratch)
+        removed = removed or len(changed) > 0
+
+    pixels[:, :] = unpadded
+    return removed
+
+
+def _clean_up_everywhere(pixels):
+    """
+    One round of remove_stragglers over the whole image, in place. Returns the flat indices of the pixels it changed
+    """
+    before = pixels.copy()
     height, width = pixels.shape[0] - 2, pixels.shape[1] - 2  # Adjust for padding
 
     # Extract sub-arrays for each neighbor position (avoiding the added padding in calculations)
@@ -811,15 +875,11 @@ def remove_stragglers(pixels):
 
     # Detect and remove stragglers (pixels with 1 or 2 neighbors)
     stragglers = (core_pixels == 1) & (neighbor_sum <= 2)
-    if np.any(stragglers):
-        core_pixels[stragglers] = 0
-        removed = True
+    core_pixels[stragglers] = 0
 
     # Detect and fill cracks (0s with 6 or more neighbors)
     cracks = (core_pixels == 0) & (neighbor_sum >= 6)
-    if np.any(cracks):
-        core_pixels[cracks] = 1
-        removed = True
+    core_pixels[cracks] = 1
 
     # Remove peninsulas (the 3x3 center of a 5x5 slice, where only one border pixel is white (1)
     # and the center pixel is white). The 3x3 center will all be set to 0
@@ -848,15 +908,47 @@ def remove_stragglers(pixels):
     peninsulas = ndimage.binary_dilation(peninsulas, structure=struct2)
 
     # Zero all of those peninsula pixels
-    if np.any(peninsulas):
-        pixels[peninsulas] = 0
-        removed = True
+    pixels[peninsulas] = 0
+
+    return np.flatnonzero(pixels != before)
+
+
+def _clean_up_around(work, width, changed, inside, core, scratch):
+    """
+    One round of remove_stragglers, in place on the flattened (and widely padded) `work`, only looking at the pixels
+    that could change given that the pixels at flat indices `changed` just did. Returns the flat indices of the pixels it changed
+    `scratch` is a copy of `work` and an array of Falses the same size, which we leave as we found them
+    """
+    def _around(indices, radius):
+        offsets = np.array([dy * width + dx for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1)])
+        return np.unique((indices[:, np.newaxis] + offsets).reshape(-1))
+
+    # the pixels this round might change, the centers of the peninsulas that could reach them, and the pixels those look at
+    candidates = _around(changed, STRAGGLER_CLEANUP_REACH)
+    candidates = candidates[inside[candidates]]
+    centers = _around(candidates, 1)
+    looked_at = _around(centers, 2)
+
+    # remove stragglers and fill cracks, wherever a peninsula we're checking for looks
+    staged, in_peninsula = scratch
+    looked_at = looked_at[core[looked_at]]
+    neighbor_sum = sum(work[looked_at + dy * width + dx].astype(np.int64) for dy in range(-1, 2) for dx in range(-1, 2) if not (dy == 0 and dx == 0))
+    values = work[looked_at]
+    staged[looked_at] = np.where((values == 1) & (neighbor_sum <= 2), 0, np.where((values == 0) & (neighbor_sum >= 6), 1, values))
+
+    # then remove peninsulas (see _clean_up_everywhere)
+    border_sum = sum(staged[centers + dy * width + dx].astype(np.int64) for dy in range(-2, 3) for dx in range(-2, 3) if max(abs(dy), abs(dx)) == 2)
+    peninsulas = _around(centers[(staged[centers] == 1) & (border_sum == 1)], 1)
+    in_peninsula[peninsulas] = True
 
-    # Recurse if changes were made
-    if removed:
-        return remove_stragglers(pixels)
+    values = np.where(in_peninsula[candidates], 0, staged[candidates])
+    changed = candidates[values != work[candidates]]
+    work[candidates] = values
 
-    return False
+    staged[looked_at] = work[looked_at]
+    staged[candidates] = values
+    in_peninsula[peninsulas] = False
+    return changed
 
 
 def remove_tiny_islands(pixels, ignore_islands_along_border=False, island_value=1):
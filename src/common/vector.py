@@ -1,5 +1,3 @@
-import itertools
-import json
 import math
 import os
 from typing import List
@@ -27,10 +25,22 @@ SIDES_ORTHOGONAL_THRESHOLD_DEG = 50
 # A side must be at least this long to be considered an edge
 EDGE_WIDTH_MIN_RATIO = 0.4
 
+# The 8 neighbors of a pixel as (dx, dy), sweeping clockwise from the one above
+NEIGHBOR_OFFSETS = [(0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)]
+
+# NEXT_NEIGHBOR[mask][start] is the first neighbor k, sweeping clockwise from `start`, whose bit is set in `mask`, or -1 if none are
+NEXT_NEIGHBOR = [[next((k % 8 for k in range(start, start + 8) if mask & (1 << (k % 8))), -1) for start in range(8)] for mask in range(256)]
+
 # scale pixel offsets depending on how big the BMPs are
 # 1.0 is tuned for around 100 pixels wide
 SCALAR = 9.45
 
+# When scoring a vertex as a corner candidate (see Candidate):
+VEC_OFFSET = 1 if SCALAR < 2 else 2    # we start comparing to this many points away, as really short vectors have noisy angles
+VEC_LEN_FOR_STDEV = round(8 * SCALAR)  # compare this many total points to see the curvature
+VEC_LEN_FOR_ANGLE = round(3 * SCALAR)  # compare this many total points to see the width of the angle of this corner
+VEC_LEN_FOR_CURVE = round(9 * SCALAR)  # wrap around these spokes and see if they form a clean curve or not
+
 
 def load_and_vectorize(args):
     filename, id, output_path, metadata, photo_space_position, scale_factor, render = args
@@ -42,6 +52,120 @@ def load_and_vectorize(args):
         raise e
 
 
+def _spokes(vs, at, first, last):
+    """
+    util.colinearity from each vertex in `at` to the vertices from `first` to `last` places after it (wrapping around the outline):
+    returns the average angle and the angular stdev of each set of spokes
+    """
+    rows = (at[:, np.newaxis] + np.arange(first, last + 1)) % len(vs)
+    d = vs[rows] - vs[at][:, np.newaxis]
+    angles = np.arctan2(d[..., 1], d[..., 0])
+    sin, cos = np.sin(angles), np.cos(angles)
+
+    average = np.arctan2(np.sum(sin, axis=1), np.sum(cos, axis=1))
+    average = np.where(average < 0, average + 2 * math.pi, average)
+
+    mean = np.arctan2(np.mean(sin, axis=1), np.mean(cos, axis=1))[:, np.newaxis]
+    deviations = np.arctan2(np.sin(angles - mean), np.cos(angles - mean))
+    return average, np.std(deviations, axis=1)
+
+
+def _counterclockwise_angles_between_vectors(h, i, j):
+    """
+    util.counterclockwise_angle_between_vectors for arrays of points
+    """
+    v1 = h - i
+    v2 = j - i
+    v1 = v1 / np.sqrt(np.sum(v1 * v1, axis=-1))[..., np.newaxis]
+    v2 = v2 / np.sqrt(np.sum(v2 * v2, axis=-1))[..., np.newaxis]
+
+    dot_product = v1[..., 0] * v2[..., 0] + v1[..., 1] * v2[..., 1]
+    determinant = v1[..., 0] * v2[..., 1] - v1[..., 1] * v2[..., 0]
+    angle = np.arctan2(determinant, dot_product)
+    angle = np.where(angle < 0, angle + 2 * np.pi, angle)
+    return 2 * np.pi - angle
+
+
+def _compare_angles(angle1, angle2):
+    """
+    util.compare_angles for arrays of angles
+    """
+    diff = np.abs(np.mod(angle1, 2 * math.pi) - np.mod(angle2, 2 * math.pi))
+    return np.minimum(diff, 2 * math.pi - diff)
+
+
+def _curve_scores(vs, at, half_width):
+    """
+    util.curve_score of the vertices from `half_width` before to `half_width` after each vertex in `at`
+    Returns the scores, and whether we could compute each one: we can't if any of the points we'd measure an angle at
+    coincides with one of its neighbors
+    """
+    n = len(vs)
+    gap = util.CURVE_SCORE_GAP
+    before, after = np.roll(vs, gap, axis=0), np.roll(vs, -gap, axis=0)
+
+    # the angle at every point of the outline, to the points `gap` away on either side (which is nan wherever they coincide)
+    with np.errstate(invalid='ignore'):
+        angles = _counterclockwise_angles_between_vectors(before, vs, after)
+    identical = np.all(before == vs, axis=1) | np.all(after == vs, axis=1) | np.all(before == after, axis=1)
+
+    rows = (at[:, np.newaxis] + np.arange(-half_width + gap, half_width - gap + 1)) % n
+    angles = angles[rows]
+    ok = ~np.any(identical[rows], axis=1)
+
+    average = np.arctan2(np.mean(np.sin(angles), axis=1), np.mean(np.cos(angles), axis=1))[:, np.newaxis]
+    deviations = _compare_angles(angles, average)
+
+    # weigh the change in angle more the closer to the center of the window it is
+    mid = angles.shape[1] // 2
+    weights = 1 - np.abs(np.arange(angles.shape[1]) - mid) / mid
+    normalized_deviation = np.sum(np.abs(deviations) * weights, axis=1) / np.sum(weights)
+    score = np.clip(3 * (0.4 - normalized_deviation), 0.0, 1.0)
+    return score, ok
+
+
+def _corner_pair_scores(pairs, scores, radial_pos, dcenter, midangles):
+    """
+    Given pairs of candidate corners (indices into the per-candidate arrays), we produce a unitless score for how good each is
+    as a pair of opposing corners. Lower is better
+    """
+    c0, c1 = pairs[:, 0], pairs[:, 1]
+
+    # first, start with the score of each individual corner
+    score = 1.2 * (scores[c0] + scores[c1])
+
+    # we want opposing corners to be roughly 180º radially around the center from each other
+    d180 = np.abs(np.abs(radial_pos[c0] - radial_pos[c1]) - math.pi)
+    score += 0.5 * d180
+
+    # the corners should be roughly the same distance from the centroid
+    dcenter_delta = np.abs(dcenter[c0] - dcenter[c1]) / np.maximum(dcenter[c0], dcenter[c1])
+    score += 0.2 * dcenter_delta
+
+    # we also want them opening up toward each other
+    # (the rays that shoot out should be about 180 degrees apart)
+    d180_deg = np.abs(np.abs(midangles[c0] - midangles[c1]) - math.pi) * 180 / math.pi
+    score += 0.005 * d180_deg
+    return score
+
+
+def _corner_quad_scores(quads, pair_scores, radial_pos):
+    """
+    Scores sets of 4 candidate corners, each made of two pairs whose scores add up to `pair_scores`. Lower is better
+    """
+    # penalize if the corners are not evenly spread out
+    # we want the corners to be roughly 90º radially around the center from each other
+    angles = np.sort(radial_pos[quads], axis=1)
+    deltas = _compare_angles(angles, np.roll(angles, -1, axis=1))
+    penalties = 0.3 * np.abs(deltas - math.pi / 2)
+    score = pair_scores + (((penalties[:, 0] + penalties[:, 1]) + penalties[:, 2]) + penalties[:, 3])
+
+    min_delta = np.min(deltas, axis=1)
+    tight = min_delta < 10 * math.pi / 180
+    score[tight] += 1.0 / (min_delta[tight] + 0.01)
+    return score
+
+
 class Candidate(object):
     @staticmethod
     def from_vertex(vertices, i, centroid, debug=False):
@@ -52,10 +176,7 @@ class Candidate(object):
             print(f"\n\n\n!!!!!!!!!!!!!! {v_i} !!!!!!!!!!!!!!!\n")
 
         # find the angle from i to the points before it (h), and i to the points after (j)
-        vec_offset = 1 if SCALAR < 2 else 2    # we start comparing to this many points away, as really short vectors have noisy angles
-        vec_len_for_stdev = round(8 * SCALAR)  # compare this many total points to see the curvature
-        vec_len_for_angle = round(3 * SCALAR)  # compare this many total points to see the width of the angle of this corner
-        vec_len_for_curve = round(9 * SCALAR)  # wrap around these spokes and see if they form a clean curve or not
+        vec_offset, vec_len_for_stdev, vec_len_for_angle, vec_len_for_curve = VEC_OFFSET, VEC_LEN_FOR_STDEV, VEC_LEN_FOR_ANGLE, VEC_LEN_FOR_CURVE
 
         a_ih, _ = util.colinearity(from_point=vertices[i], to_points=util.slice(vertices, i-vec_len_for_angle-vec_offset, i-vec_offset-1))
         a_ij, _ = util.colinearity(from_point=vertices[i], to_points=util.slice(vertices, i+vec_offset+1, i+vec_len_for_angle+vec_offset))
@@ -103,6 +224,48 @@ class Candidate(object):
 
         return candidate
 
+    @staticmethod
+    def from_vertices(vertices, centroid):
+        """
+        Candidate.from_vertex for every vertex of a closed outline at once, using rolling windows over the vertices
+        Returns the candidates in order of i, and the indices of any vertices we couldn't compute a curve score for
+        """
+        n = len(vertices)
+        vs = np.array(vertices, dtype=np.float64)
+        at = np.arange(n)
+
+        a_ih, _ = _spokes(vs, at, -VEC_LEN_FOR_ANGLE - VEC_OFFSET, -VEC_OFFSET - 1)
+        a_ij, _ = _spokes(vs, at, VEC_OFFSET + 1, VEC_LEN_FOR_ANGLE + VEC_OFFSET)
+
+        # extend out along the avg spoke direction
+        p_h = vs + 10 * np.stack([np.cos(a_ih), np.sin(a_ih)], axis=1)
+        p_j = vs + 10 * np.stack([np.cos(a_ij), np.sin(a_ij)], axis=1)
+
+        # how wide is the angle between the two legs?
+        angle_hij = _counterclockwise_angles_between_vectors(p_h, vs, p_j)
+
+        a_ic = np.arctan2(centroid[1] - vs[:, 1], centroid[0] - vs[:, 0])
+        midpoint = (p_h + p_j) / 2
+        midangle = np.arctan2(midpoint[:, 1] - vs[:, 1], midpoint[:, 0] - vs[:, 0])
+        offset_from_center = _compare_angles(midangle, a_ic)
+
+        is_pointed_toward_center = (offset_from_center < angle_hij / 2) | ((angle_hij < 90 * math.pi/180) & (np.abs(offset_from_center) <= 45 * math.pi/180))
+        is_valid_angle_width = (angle_hij >= CORNER_MIN_ANGLE_DEG * math.pi/180) & (angle_hij <= CORNER_MAX_ANGLE_DEG * math.pi/180)
+        at = at[is_pointed_toward_center & is_valid_angle_width]
+
+        # see how straight the spokes are from these points, and what angle they jut out at
+        _, stdev_h = _spokes(vs, at, -VEC_LEN_FOR_STDEV - VEC_OFFSET, -VEC_OFFSET - 1)
+        _, stdev_j = _spokes(vs, at, VEC_OFFSET + 1, VEC_LEN_FOR_STDEV + VEC_OFFSET)
+        stdev = stdev_h + stdev_j
+
+        curve_score, ok = _curve_scores(vs, at, VEC_LEN_FOR_CURVE)
+
+        candidates = []
+        for k, i in enumerate(at.tolist()):
+            if ok[k]:
+                candidates.append(Candidate(v=vertices[i], i=i, centroid=centroid, angular_width=float(angle_hij[i]), offset_from_center=float(offset_from_center[i]), midangle=float(midangle[i]), stdev=float(stdev[k]), curve_score=float(curve_score[k])))
+        return candidates, at[~ok].tolist()
+
     def __init__(self, v, i, centroid, angular_width=10000, offset_from_center=10000, stdev=10000, midangle=10000, curve_score=10000,):
         self.v = v
         self.i = i
@@ -185,14 +348,14 @@ class Vector(object):
 
         if output_path:
             try:
-                self.save(output_path, metadata)
+                return self.save(output_path, metadata)
             except Exception as e:
                 print(f"Error while saving id {self.id} in file {self.filename}:")
                 raise e
         else:
             return self
 
-    def save(self, output_path, metadata, only_save_edges=False) -> None:
+    def save(self, output_path, metadata, only_save_edges=False) -> dict:
         if only_save_edges and not any([s.is_edge for s in self.sides]):
             # it's sometimes nice to debug how the border of the puzzle looks
             return
@@ -233,19 +396,14 @@ class Vector(object):
         with open(svg_path, 'w') as f:
             f.write(svg)
 
-        # Then we save off the side data for future processing steps
-        for i, side in enumerate(self.sides):
-            side_path = pathlib.Path(output_path).joinpath(f"side_{self.id}_{i}.json")
-            # convert vertices from np types to native python types
-            vertices = [[int(v[0]), int(v[1])] for v in side.vertices]
-            metadata['piece_id'] = self.id
-            metadata['side_index'] = i
-            metadata['vertices'] = vertices
-            metadata['piece_center'] = list(side.piece_center)
-            metadata['is_edge'] = side.is_edge
-            metadata['incenter'] = list(self.incenter)
-            with open(side_path, 'w') as f:
-                f.write(json.dumps(metadata))
+        # Then we hand back the side data for future processing steps, for the caller to put in the piece store (see piece_store.py)
+        piece = dict(metadata)
+        piece['piece_id'] = self.id
+        piece['vertices'] = [[[int(v[0]), int(v[1])] for v in side.vertices] for side in self.sides]
+        piece['piece_center'] = [float(c) for c in self.centroid]
+        piece['is_edge'] = [side.is_edge for side in self.sides]
+        piece['incenter'] = [float(c) for c in self.incenter]
+        return piece
 
     def find_border_raster(self) -> None:
         # Ensure pixels is a numpy array
@@ -269,64 +427,45 @@ class Vector(object):
         """
         We want to "wind" a string around the border
         So we find the top-left most border pixel, then sweep a polyline around the border
-        As we go, we capture how much the angle of the polyline changes at each step
         """
 
-        # start at the first border pixel we find
-        indices = np.argwhere(self.border == 1)
-        sy, sx = tuple(indices[0])
-
-        self.vertices = [(sx, sy)]
-        cx, cy = sx, sy
-        p_angle = 0
-
-        closed = False
-        while not closed:
-            neighbors = [
-                # Clockwise sweep
-                (cx,     cy - 1),  # above
-                (cx + 1, cy - 1),  # above right
-                (cx + 1, cy),      # right
-                (cx + 1, cy + 1),  # below right
-                (cx,     cy + 1),  # below
-                (cx - 1, cy + 1),  # below left
-                (cx - 1, cy),      # left
-                (cx - 1, cy - 1),  # above left
-            ]
-            # pick where to start by looking at the current (absolute) angle, and looking
-            # "back over our left shoulder" at the neighbor most in that direction, then sweep CW around the neighbors
-            shift = int(round(p_angle * float(len(neighbors))/(2 * math.pi)))  # scale to wrap the full circle over the number of neighbors
-
-            bx, by = cx, cy
-
-            # check each neighbor in order to see if it is also a border
-            # once we find one that is a border, add a point to it and continue
-            for i in range(0 + shift, 8 + shift):
-                nx, ny = neighbors[i % len(neighbors)]
-                n = self.border[ny][nx]
-                if n == 1:
-                    dx, dy = nx - cx, ny - cy
-                    abs_angle = math.atan2(dy, dx)
-                    rel_angle = abs_angle - p_angle
-                    p_angle = abs_angle
-
-                    if rel_angle < 0:
-                        rel_angle += 2 * math.pi
-
-                    if self.vertices[-1] != (cx, cy):
-                        self.vertices.append((cx, cy))
-
-                    cx, cy = nx, ny
-                    if cx == sx and cy == sy:
-                        closed = True
-
-                    break
+        # Each step only depends on which of the current pixel's neighbors are border pixels, and which way we came in:
+        # we look "back over our left shoulder" at the neighbor most in the direction we were already heading, then sweep CW
+        # around the neighbors until we find another border pixel. So we gather every border pixel's neighbors into a bitmask
+        # all at once, and each step is a lookup in NEXT_NEIGHBOR, rather than checking the neighbors one by one
+        # (find_border_raster never marks the outermost pixels, so every border pixel's neighbors are inside the bitmap)
+        width = self.border.shape[1]
+        steps = [dy * width + dx for (dx, dy) in NEIGHBOR_OFFSETS]
+        is_border = (self.border == 1).reshape(-1)
+        flat = np.flatnonzero(is_border)
+        masks = np.zeros(len(flat), dtype=np.int32)
+        for k, step in enumerate(steps):
+            masks |= is_border[flat + step].astype(np.int32) << k
+        neighbor_masks = dict(zip(flat.tolist(), masks.tolist()))
 
-            if bx == cx and by == cy:
+        # start at the first border pixel we find
+        start = int(flat[0])
+        path = [start]
+        p = start
+        k = 2  # as if we had just stepped right, so we start looking straight up
+        while True:
+            k = NEXT_NEIGHBOR[neighbor_masks[p]][(k - 2) % 8]
+            if k < 0:
                 raise Exception(f"Piece @ {self.id} will get us stuck in a loop because the border goes up to the edge of the bitmap. Take a new picture with the piece centered better or make sure the background is brighter white.")
+            p += steps[k]
+            if p == start:
+                break
+            path.append(p)
+            if len(path) > 8 * len(neighbor_masks):
+                # we can only be at each border pixel heading each way once before we start going round in circles
+                raise Exception(f"Piece @ {self.id} has a border that never leads back to where we started tracing it")
+
+        path = np.array(path)
+        xy = np.stack([path % width, path // width], axis=1)
+        self.vertices = list(zip(*xy.T.tolist()))
 
-        self.centroid = util.centroid(self.vertices)
-        self.incenter = util.incenter(self.vertices)
+        self.centroid = util.centroid(xy)
+        self.incenter = util.incenter(self.pixels)
 
     def merge_close_points(self, vs, threshold):
         i = -len(vs)
@@ -357,26 +496,25 @@ class Vector(object):
         """
         Finds corners by evaluating the score at each each point
         """
-        candidates = []
-
         # to find a corner, we're going to compute the angle between 3 consecutive points
         # if it is roughly 90º and pointed toward the center, it's a corner
-        for i in range(len(self.vertices)):
-            debug = self.vertices[i][1] in (2260, 1250)
-            candidate = None
-            try:
-                candidate = Candidate.from_vertex(self.vertices, i, self.centroid, debug=debug)
-            except Exception as e:
-                print(f"Error while computing curve score for piece {self.id}: {e}")
-            curve_score = 0.0
-
-            if not candidate or candidate.score() > 3.0:
-                if debug:
-                    print(f">>>>>> Skipping; score too high: {candidate.score() if candidate else 0.0}")
-                continue
-            candidates.append(candidate)
+        if len(self.vertices) > 2 * VEC_LEN_FOR_CURVE + 1:
+            candidates, failed = Candidate.from_vertices(self.vertices, self.centroid)
+            for i in failed:
+                print(f"Error while computing curve score for piece {self.id}: vertices around {self.vertices[i]} overlap")
+        else:
+            # too few vertices for the windows to not overlap themselves, which Candidate.from_vertex has its own way of dealing with
+            candidates = []
+            for i in range(len(self.vertices)):
+                try:
+                    candidate = Candidate.from_vertex(self.vertices, i, self.centroid)
+                except Exception as e:
+                    print(f"Error while computing curve score for piece {self.id}: {e}")
+                    continue
+                if candidate:
+                    candidates.append(candidate)
 
-        return candidates
+        return [candidate for candidate in candidates if candidate.score() <= 3.0]
 
     def merge_nearby_candidates(self, candidates):
         """
@@ -414,120 +552,37 @@ class Vector(object):
         # compute each corner's score, and only consider the n best corners
         candidates = sorted(candidates, key=lambda c: c.score())[:12]
 
-        # for c in candidates:
-        #     print(c)
-
         if len(candidates) < 4:
             raise Exception(f"Expected at least 4 candidates, found {len(candidates)} on piece {self.id}")
 
-        def _score_2_candidates(c0, c1):
-            """
-            Given a pair of candidate corners, we produce a unitless score for how good they are
-            Lower is better
-            """
-            debug = (c0.v[1] == 6300)
-
-            # first, start with the score of each individual corner
-            score = 1.2 * (c0.score() + c1.score())
-            if debug:
-                print("==========")
-                print(c0)
-                print(c1)
-                print(f"\tInitial score: {score}")
-
-            # we want opposing corners to be roughly 180º radially around the center from each other
-            radial_pos0 = util.angle_between(self.centroid, c0.v)
-            radial_pos1 = util.angle_between(self.centroid, c1.v)
-            radial_delta = abs(radial_pos0 - radial_pos1)
-            d180 = abs(radial_delta - math.pi)
-            radial_delta_penalty = 0.5 * d180
-            score += radial_delta_penalty
-            if debug:
-                print(f"\tradial_pos0: {round(radial_pos0 * 180 / math.pi)}º, radial_pos1: {round(radial_pos1 * 180 / math.pi)}º, delta: {round(radial_delta * 180 / math.pi)}º, d180: {round(d180 * 180 / math.pi)}º => penalty = {round(radial_delta_penalty, 2)}")
-                print(f"\tscore: {score}")
-
-            # the corners should be roughly the same distance from the centroid
-            dcenter0 = util.distance(c0.v, self.centroid)
-            dcenter1 = util.distance(c1.v, self.centroid)
-            dcenter_delta = abs(dcenter0 - dcenter1)/max(dcenter0, dcenter1)
-            score += 0.2 * dcenter_delta
-            if debug:
-                print(f"\tdcenter0: {round(dcenter0)}, dcenter1: {round(dcenter1)}, delta: {round(dcenter_delta, 2)} => penalty = {round(0.1 * dcenter_delta, 2)}")
-                print(f"\tscore: {score}")
-
-            # we also want them opening up toward each other
-            # (the rays that shoot out should be about 180 degrees apart)
-            orientation_delta = abs(c0.midangle - c1.midangle)
-            d180_deg = abs(orientation_delta - math.pi) * 180/math.pi
-            orientation_penalty = 0.005 * (d180_deg ** 1.0)
-            score += orientation_penalty
-            if debug:
-                print(f"\torientation_delta: {round(orientation_delta * 180 / math.pi)}º, d180: {round(d180_deg)}º => penalty = {round(orientation_penalty, 2)}")
-                print(f"\tFinal score: {score}\n")
-
-            return (c0, c1, score)
-
-        def _score_4_candidates(pair0, pair1):
-            c0, c1, s01 = pair0
-            c2, c3, s23 = pair1
-            score = s01 + s23
+        # everything we need to know about each candidate to score it as part of a set, up front
+        scores = np.array([c.score() for c in candidates], dtype=np.float64)
+        radial_pos = np.array([util.angle_between(self.centroid, c.v) for c in candidates], dtype=np.float64)
+        dcenter = np.array([util.distance(c.v, self.centroid) for c in candidates], dtype=np.float64)
+        midangles = np.array([c.midangle for c in candidates], dtype=np.float64)
 
-            # sort the angles by order of radial position around the centroid
-            cs = sorted([c0, c1, c2, c3], key=lambda c: util.angle_between(self.centroid, c.v))
-
-            ys = [c.v[1] for c in [c0, c1, c2, c3]]
-            debug = 27 in ys and 8 in ys and 4420 in ys
-            if debug:
-                print("==========")
-                for c in cs:
-                    print(f" - {c.v}")
-                print(f"Base Score: {score}")
-
-            # penalize if the corners are not evenly spread out
-            # we want the corners to be roughly 90º radially around the center from each other
-            angles = [util.angle_between(self.centroid, c.v) for c in cs]
-
-            if debug:
-                for i in range(4):
-                    print(f" \t [{i}] {round(angles[i] * 180 / math.pi)}° for {cs[i]}")
-            delta_angle_01 = util.compare_angles(angles[0], angles[1])
-            delta_angle_12 = util.compare_angles(angles[1], angles[2])
-            delta_angle_23 = util.compare_angles(angles[2], angles[3])
-            delta_angle_30 = util.compare_angles(angles[3], angles[0])
-            if debug:
-                print(f" \t   Deltas: {round(delta_angle_01 * 180 / math.pi)}°, {round(delta_angle_12 * 180 / math.pi)}°, {round(delta_angle_23 * 180 / math.pi)}°, {round(delta_angle_30 * 180 / math.pi)}°")
-            score_01 = 0.3 * abs(delta_angle_01 - math.pi/2)
-            score_12 = 0.3 * abs(delta_angle_12 - math.pi/2)
-            score_23 = 0.3 * abs(delta_angle_23 - math.pi/2)
-            score_30 = 0.3 * abs(delta_angle_30 - math.pi/2)
-            if debug:
-                print(f" \t   Penalties: {round(score_01, 2)}, {round(score_12, 2)}, {round(score_23, 2)}, {round(score_30, 2)}")
-            score += score_01 + score_12 + score_23 + score_30
-            if debug:
-                print(f"\t Score: {score}")
-
-            min_delta = min([delta_angle_01, delta_angle_12, delta_angle_23, delta_angle_30])
-            if min_delta < 10 * math.pi/180:
-                score += 1.0 / (min_delta + 0.01)
-                if debug:
-                    print(f"\t Score after tight min-delta: {score}")
-
-            cs.append(score)
-            return cs
-
-        # Generate all pair combos and score them each up as proposed diagonal corners
-        all_pairs = list(itertools.combinations(candidates, 2))
-        all_pair_scores = sorted([_score_2_candidates(c0, c1) for (c0, c1) in all_pairs], key=lambda r: r[2])
-
-        # sort so we have a list of pairs, lowest (best) score first
-        all_pair_scores = sorted(all_pair_scores, key=lambda c: c[2])
-        all_pair_scores = all_pair_scores[:30]  # only consider the best n pairs to save on compute
+        # Score every pair combo as proposed diagonal corners, and only consider the best n pairs to save on compute
+        pairs = np.stack(np.triu_indices(len(candidates), 1), axis=1)  # in itertools.combinations order
+        pair_scores = _corner_pair_scores(pairs, scores, radial_pos, dcenter, midangles)
+        best_pairs = np.argsort(pair_scores, kind='stable')[:30]
+        pairs, pair_scores = pairs[best_pairs], pair_scores[best_pairs]
 
         # compare pairs of pairs to see how well they work
-        all_pair_pairs = list(itertools.combinations(all_pair_scores, 2))
-        all_pair_pair_scores = sorted([_score_4_candidates(pair0, pair1) for (pair0, pair1) in all_pair_pairs], key=lambda c: c[4])
-
-        selected_candidates = all_pair_pair_scores[0][0:4]
+        # A set of 4 never scores better than the sum of its two pairs' scores, and the pairs are sorted best first,
+        # so once we've scored the set made of the two best pairs, we only need to look at sets that could beat it
+        p0, p1 = np.triu_indices(len(pairs), 1)
+        bounds = pair_scores[p0] + pair_scores[p1]
+        quads = np.concatenate([pairs[p0], pairs[p1]], axis=1)
+        best = _corner_quad_scores(quads[:1], bounds[:1], radial_pos)[0]
+        contenders = np.flatnonzero(bounds < best)
+        if len(contenders) > 0:
+            quad_scores = _corner_quad_scores(quads[contenders], bounds[contenders], radial_pos)
+            k = np.argmin(quad_scores)
+            if quad_scores[k] < best:
+                quads = quads[contenders[k:k + 1]]
+
+        # sort the corners by order of radial position around the centroid
+        selected_candidates = sorted([candidates[i] for i in quads[0].tolist()], key=lambda c: util.angle_between(self.centroid, c.v))
         self.corners = [c.v for c in selected_candidates]
         self.corner_indices = [c.i for c in selected_candidates]
 
@@ -697,7 +752,9 @@ class Vector(object):
             lines[py][px] = f"{util.BLACK_ON_BLUE}{value} {util.WHITE}"
 
         lines[self.centroid[1]][self.centroid[0]] = f"{util.BLACK_ON_RED}X {util.WHITE}"
-        lines[self.incenter[1]][self.incenter[0]] = f"{util.BLACK_ON_GREEN}. {util.WHITE}"
+        # the incenter lands between pixels, so mark the pixel it's in
+        incenter_x, incenter_y = int(round(self.incenter[0])), int(round(self.incenter[1]))
+        lines[incenter_y][incenter_x] = f"{util.BLACK_ON_GREEN}. {util.WHITE}"
 
         print(f' {util.GRAY} ' + 'v ' * self.width + f"{util.WHITE}")
         for i, line in enumerate(lines):
@@ -9,7 +9,7 @@ import re
 import pathlib
 import json
 
-from common import bmp, extract, util, vector, dedupe
+from common import bmp, extract, util, vector, dedupe, piece_store
 from common.config import *
 
 
@@ -155,11 +155,16 @@ def _vectorize_all(input_path, output_path, metadata, robot_states, photo_space_
         i += 1
 
     if serialize:
-        for arg in args:
-            vector.load_and_vectorize(arg)
+        pieces = [vector.load_and_vectorize(arg) for arg in args]
     else:
         with multiprocessing.Pool(processes=os.cpu_count()) as pool:
-            pool.map(vector.load_and_vectorize, args)
+            pieces = pool.map(vector.load_and_vectorize, args)
+
+    # every worker hands its piece back to us, and we write them all to the piece store in one go
+    store = piece_store.load(output_path) if (id and piece_store.exists(output_path)) else {}
+    for piece in pieces:
+        store[piece['piece_id']] = piece
+    piece_store.save(output_path, store)
 
     duration = time.time() - start_time
     print(f"Vectorizing took {round(duration, 2)} seconds")
@@ -35,8 +35,13 @@ def main():
     parser.add_argument('--start-at-step', default=0, required=False, help='Start processing at this step', type=int)
     parser.add_argument('--stop-before-step', default=10, required=False, help='Stop processing at this step', type=int)
     parser.add_argument('--serialize', default=False, action="store_true", help='Single-thread processing')
+    parser.add_argument('--resume', default=False, action="store_true", help='Resume solving (step 6) from where an interrupted run left off')
     args = parser.parse_args()
 
+    if args.resume:
+        # the checkpoints live in the solution directory, so don't redo (and wipe) anything that comes before it
+        args.start_at_step = max(args.start_at_step, 6)
+
     start_time = time.time()
 
     _prepare_new_run(path=args.path, start_at_step=args.start_at_step, stop_before_step=args.stop_before_step)
@@ -51,7 +56,7 @@ def main():
 
     process.batch_process_photos(path=args.path, serialize=args.serialize, robot_states=robot_states, id=args.only_process_id, start_at_step=args.start_at_step, stop_before_step=args.stop_before_step)
     if args.stop_before_step is not None and args.stop_before_step >= 3 and args.only_process_id is None:
-        solve.solve(path=args.path, start_at=args.start_at_step)
+        solve.solve(path=args.path, start_at=args.start_at_step, resume=args.resume)
 
     duration = time.time() - start_time
     print(f"\n\n{util.GREEN}### Ran in {round(duration, 2)} sec ###{util.WHITE}\n")